@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+
+# cliapi benchmarks, built on the "test" provider and a local mock IMDS.
+#
+#   python benchmarks/bench.py                       run, print JSON results
+#   python benchmarks/bench.py -o results.json       ...and save them
+#   python benchmarks/bench.py --compare base.json   flag regressions against
+#                                                    a saved run (exit code 1)
+#
+# Every benchmark reports timings in seconds (min/median/mean over its
+# repeats); the output benchmark also reports the size of each encoding.
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, root)
+sys.path.insert(0, here)
+
+
+def _summary(samples, **extra):
+    result = {'min': min(samples),
+              'median': statistics.median(samples),
+              'mean': statistics.mean(samples),
+              'repeats': len(samples)}
+    result.update(extra)
+    return result
+
+
+def _timed(func, repeats, setup=None):
+    samples = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _cli(args, env):
+    subprocess.run([sys.executable, '-m', 'cliapi.cliapi', '--no-daemon'] + args,
+                   cwd=root, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def bench_startup(repeats, cache_root):
+    # whole process runs, "cold" rebuilds the provider manifest and
+    # detects the cloud again, "warm" reuses the cache directory...
+    results = {}
+    warm_dir = os.path.join(cache_root, 'warm')
+    env = dict(os.environ, CLIAPI_CACHE_DIR=warm_dir,
+               PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    commands = {'list-providers': ['--list-providers'],
+                'internal-ip': ['--provider=test', '--internal-ip'],
+                'all': ['--provider=test', '--all', '--smurf=bench']}
+    for name, args in commands.items():
+        cold_dir = os.path.join(cache_root, 'cold')
+
+        def wipe():
+            shutil.rmtree(cold_dir, ignore_errors=True)
+        cold_env = dict(env, CLIAPI_CACHE_DIR=cold_dir)
+        results['cold ' + name] = _summary(
+            _timed(lambda: _cli(args, cold_env), repeats, wipe))
+        _cli(args, env)
+        results['warm ' + name] = _summary(
+            _timed(lambda: _cli(args, env), repeats))
+    return results
+
+
+def bench_fault_in(repeats):
+    # Provider.__getitem__ on a miss, without the cross-invocation cache...
+    import cliapi.providers.test as test
+    vpp = test.provider
+    vpp.configure({'smurf': 'bench'})
+    vpp.cache_mode = 'off'
+    loops = 1000
+    results = {}
+    for alias in vpp.fetchers:
+        def fault_in():
+            for _ in range(loops):
+                vpp.forget(alias)
+                vpp[alias]
+        samples = [t / loops for t in _timed(fault_in, repeats)]
+        results['fault-in ' + alias] = _summary(samples)
+    return results
+
+
+def bench_scoops(repeats):
+    # compiled scoop lookups and ad-hoc queries over fetched data...
+    import cliapi.providers.test as test
+    from cliapi.cliapi import _sandbox_eval
+    vpp = test.provider
+    vpp.configure({'smurf': 'bench'})
+    vpp.cache_mode = 'off'
+    vpp.prefetch(vpp.fetchers)
+    loops = 10000
+    queries = [vpp.scoops[name] for name in vpp.scoops
+               if name != 'always-fail']
+
+    def scoops():
+        for _ in range(loops):
+            for name in vpp.paths:
+                if name != 'always-fail':
+                    vpp.lookup(vpp.paths[name])
+
+    def adhoc():
+        for _ in range(loops):
+            for query in queries:
+                _sandbox_eval(vpp, query)
+    results = {}
+    for name, func in (('scoop lookup', scoops), ('query eval', adhoc)):
+        samples = [t / (loops * len(queries)) for t in _timed(func, repeats)]
+        results[name] = _summary(samples, ops_per_second=1 / min(samples))
+    return results
+
+
+def bench_output(repeats):
+    # encoding the --all document in every output mode...
+    import cliapi.providers.test as test
+    from cliapi import output
+    vpp = test.provider
+    vpp.configure({'smurf': 'bench'})
+    vpp.cache_mode = 'off'
+    vpp.prefetch(vpp.fetchers)
+    keys = list(vpp.fetchers)
+    results = {}
+    for mode in output.MODES:
+        def encode():
+            out = io.StringIO()
+            output.write_mapping(keys, vpp.__getitem__, mode, out)
+            return out
+        size = len(encode().getvalue().encode('utf-8'))
+        results['output ' + mode] = _summary(_timed(encode, repeats),
+                                             bytes=size)
+    return results
+
+
+def bench_imds(repeats):
+    # the shared HTTP transport against the mock IMDS...
+    import mock_imds
+    from cliapi.transport import HttpClient
+    server, url = mock_imds.start()
+    headers = {'Metadata': 'true'}
+    full = url + '/metadata/instance?api-version=2017-08-01'
+    leaf = url + '/metadata/instance/compute/location?api-version=2017-08-01&format=text'
+    try:
+        results = {}
+        keepalive = HttpClient()
+
+        def fresh():
+            client = HttpClient()
+            client.get_json(full, headers)
+            client.close()
+        results['imds new connection'] = _summary(_timed(fresh, repeats))
+        keepalive.get(full, headers)
+        keepalive.etags.clear()
+
+        def pooled():
+            keepalive.etags.clear()
+            keepalive.get_json(full, headers)
+        results['imds keep-alive'] = _summary(_timed(pooled, repeats))
+        keepalive.get(full, headers)
+        results['imds etag revalidation'] = _summary(
+            _timed(lambda: keepalive.get_json(full, headers), repeats))
+        results['imds leaf (pushdown)'] = _summary(
+            _timed(lambda: keepalive.get(leaf, headers), repeats))
+        keepalive.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def run(repeats, startup_repeats):
+    cache_root = tempfile.mkdtemp(prefix='cliapi-bench-')
+    # in-process benchmarks must not touch the real cache either...
+    os.environ['CLIAPI_CACHE_DIR'] = os.path.join(cache_root, 'inproc')
+    try:
+        results = {}
+        results.update(bench_startup(startup_repeats, cache_root))
+        results.update(bench_fault_in(repeats))
+        results.update(bench_scoops(repeats))
+        results.update(bench_output(repeats))
+        results.update(bench_imds(repeats))
+    finally:
+        shutil.rmtree(cache_root, ignore_errors=True)
+    return {'python': sys.version.split()[0],
+            'timestamp': time.time(),
+            'results': results}
+
+
+def compare(current, baseline, threshold):
+    # median based comparison, returns the list of regressions...
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None or not base['median']:
+            continue
+        ratio = result['median'] / base['median']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('{:<32} {:>12.6f} {:>12.6f} {:>7.2f}x{}'.format(
+            name, base['median'], result['median'], ratio, flag),
+            file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='cliapi benchmarks')
+    parser.add_argument('-o', '--output', help='save results to this file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='flag regressions against saved results')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown of the median (default 0.25)')
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--startup-repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.repeats, args.startup_repeats)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('regressions: ' + ', '.join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+# A local stand-in for the Azure instance metadata service (IMDS).
+# It serves the document of the "test" provider with the IMDS url layout:
+#
+#   /metadata/instance?api-version=...                full document
+#   /metadata/instance/compute/location?...           any subtree by path
+#   ...&format=text                                   leaves as plain text
+#
+# Responses carry an ETag and honor If-None-Match.  Run it standalone with
+#
+#   python benchmarks/mock_imds.py [port]
+#
+# and point the azure plugin at it with CLIAPI_AZURE_IMDS=http://127.0.0.1:port
+
+import os
+import sys
+import json
+import hashlib
+import threading
+import http.server
+from urllib.parse import urlsplit, parse_qs, unquote
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, root)
+
+from cliapi.providers.test import get_meta_data_mock
+
+PREFIX = '/metadata/instance'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes, don't let Nagle delay the body...
+    disable_nagle_algorithm = True
+    document = get_meta_data_mock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', etag=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if self.headers.get('Metadata') != 'true' or \
+                not url.path.startswith(PREFIX):
+            return self._send(400)
+        value = self.document
+        parts = [unquote(p) for p in url.path[len(PREFIX):].split('/') if p]
+        try:
+            for part in parts:
+                value = value[int(part)] if isinstance(value, list) \
+                    else value[part]
+        except (KeyError, IndexError, ValueError):
+            return self._send(404)
+        if query.get('format', ['json'])[0] == 'text':
+            if isinstance(value, (dict, list)):
+                return self._send(400)
+            body = str(value).encode('utf-8')
+        elif parts and not isinstance(value, (dict, list)):
+            # like IMDS, leaves are only served as text...
+            return self._send(400)
+        else:
+            body = json.dumps(value).encode('utf-8')
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, etag=etag)
+        self._send(200, body, etag)
+
+
+def start(port=0):
+    # serve in a background thread, returns (server, base url)...
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+if __name__ == '__main__':
+    server, url = start(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    print(url)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
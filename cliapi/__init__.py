@@ -0,0 +1,16 @@
+# the in-process API (see cliapi.api) is imported on first use, so that
+# running the cliapi command does not pay for it...
+
+_api = ('query', 'invalidate', 'providers', 'apis', 'scoops')
+_errors = ('CliapiError', 'NoSuchProvider', 'NoSuchItem', 'QuerySyntaxError',
+           'BadOption', 'MissingOption', 'FetchError')
+
+
+def __getattr__(name):
+    if name in _api:
+        from cliapi import api
+        return getattr(api, name)
+    if name in _errors:
+        from cliapi import cliapi_lib
+        return getattr(cliapi_lib, name)
+    raise AttributeError(name)
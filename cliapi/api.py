@@ -0,0 +1,143 @@
+import threading
+
+from cliapi import discover
+from cliapi import refresh
+from cliapi import scoop
+from cliapi.cliapi_lib import (NoSuchProvider, NoSuchItem, QuerySyntaxError,
+                               BadOption)
+
+# The in-process Python API of cliapi, for programs which would otherwise
+# run the cliapi command and parse its output:
+#
+#   import cliapi
+#
+#   cliapi.query('azure', scoops=['location', 'internal-ip'])
+#   -> {'location': 'westus', 'internal-ip': '172.16.3.8'}
+#   cliapi.query('azure', queries=["['meta_data']['compute']['vmSize']"])
+#   cliapi.invalidate('azure', ['meta_data'])
+#
+# Nothing is printed and nothing exits, errors are raised as the
+# exceptions of cliapi.cliapi_lib (NoSuchProvider, NoSuchItem,
+# QuerySyntaxError, BadOption, MissingOption and FetchError).
+# Each provider is imported once and its API results are kept (per their
+# ttl, APIs without one are fetched again by every call) between calls,
+# like in the cliapi daemon.  The results are shared
+# with the provider, do not modify them.
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+# (stale results are refreshed on a thread, this API does not fork)
+refresh.use_threads()
+
+
+def providers(refresh=False):
+    # the providers valid on this host (the manifest is kept in memory
+    # between calls)...
+    return discover.valid_providers(discover.current_manifest(refresh))
+
+
+def _provider(name):
+    valid = providers()
+    if name is not None and name not in valid:
+        # maybe a plugin was just installed...
+        valid = providers(refresh=True)
+    if name is None:
+        if not valid:
+            raise NoSuchProvider('No plugin providers found')
+        name = valid[0]
+    elif name not in valid:
+        raise NoSuchProvider('No such provider -- "{}"'.format(name))
+    with _locks_lock:
+        lock = _locks.setdefault(name, threading.RLock())
+    return discover.load_provider(name), lock
+
+
+def apis(provider=None):
+    # the APIs of a provider (by default the first valid one)...
+    vpp, _ = _provider(provider)
+    return list(vpp.fetchers)
+
+
+def scoops(provider=None):
+    # the scoops of a provider, {name: query}...
+    vpp, _ = _provider(provider)
+    return dict(vpp.scoops)
+
+
+def _options(vpp, options):
+    names = set(v[1:] for v in vpp.options.values()
+                if isinstance(v, str) and v.startswith('$'))
+    for name in options:
+        if name not in names:
+            raise BadOption('option {} not recognized'.format(name))
+    return dict(options)
+
+
+def _paths(vpp, scoops, queries):
+    # {scoop name or query: compiled path} in the order asked...
+    paths = {}
+    for name in scoops:
+        if name not in vpp.scoops:
+            raise NoSuchItem('no such scoop -- "{}"'.format(name))
+        try:
+            paths[name] = vpp.path(name)
+        except SyntaxError:
+            raise QuerySyntaxError('option {} -- "{}", bad plugin query'
+                                   .format(name, vpp.scoops[name]))
+    for query in queries:
+        try:
+            paths[query] = scoop.compile_query(query)
+        except SyntaxError:
+            raise QuerySyntaxError('error in query -- "{}" syntax error'
+                                   .format(query))
+    return paths
+
+
+def query(provider=None, scoops=(), queries=(), options=None,
+          refresh=False, cache=True):
+    # answer scoops (by name) and queries (python dictionary syntax) as
+    # {scoop or query: value}.  Without any, every API is answered as
+    # {api: result} like --all.
+    # options are the provider's API options, e.g. {'api_version': '...'};
+    # refresh fetches the APIs again (saving the results), cache=False
+    # neither uses nor saves the cross-invocation cache...
+    vpp, lock = _provider(provider)
+    with lock:
+        vpp.configure(_options(vpp, options or {}))
+        vpp.forget_uncached()
+        if not cache:
+            vpp.cache_mode = 'off'
+        elif refresh:
+            vpp.cache_mode = 'refresh'
+
+        if not scoops and not queries:
+            aliases = list(vpp.fetchers)
+            paths = {alias: (alias,) for alias in aliases}
+        else:
+            paths = _paths(vpp, scoops, queries)
+            aliases = [scoop.api_of(path) for path in paths.values()]
+        if refresh or not cache:
+            for alias in vpp.dependencies(aliases):
+                vpp.forget(alias)
+        # a missing option is raised before anything is fetched...
+        vpp.check(aliases)
+        vpp.prefetch(list(paths.values()))
+
+        results = {}
+        for name, path in paths.items():
+            try:
+                results[name] = vpp.lookup(path)
+            except (KeyError, IndexError, TypeError):
+                raise NoSuchItem('no such item -- "{}"'.format(
+                    vpp.scoops.get(name, name)))
+        return results
+
+
+def invalidate(provider=None, apis=None):
+    # forget the results of some APIs (or all of them) of a provider, in
+    # this process and in the cross-invocation cache...
+    vpp, lock = _provider(provider)
+    with lock:
+        for alias in apis or [None]:
+            vpp.invalidate(alias)
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+
+from cliapi.cache import cache_dir, read_json
+
+# Circuit breakers of failing APIs, shared by every cliapi process.
+# After "threshold" failures in a row an API is "open": for the next
+# "window" seconds it fails fast with the error it last failed with,
+# instead of every call waiting on a missing file or a connect timeout
+# again.  Then a single caller probes it ("half-open"), the others keep
+# failing fast until the probe succeeds (closed) or fails (open again).
+# Each breaker is a small JSON file in the cache directory, updated under
+# an flock; a closed breaker has no file at all.
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, path, threshold=1, window=30):
+        self.path = path
+        self.threshold = threshold
+        self.window = window
+
+    def _update(self, change):
+        # change(state) under the lock, it returns the state to save (or
+        # None to remove the breaker) and what to return...
+        import fcntl
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.read(fd, 65536)
+            try:
+                state = json.loads(data.decode('utf-8')) if data else {}
+            except ValueError:
+                state = {}
+            state, result = change(state)
+            if state is None:
+                os.unlink(self.path)
+            else:
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, json.dumps(state).encode('utf-8'), 0)
+        finally:
+            os.close(fd)
+        return result
+
+    def check(self):
+        # None when the API may be called, otherwise the state of the open
+        # breaker: {'failures': n, 'error': message, 'until': time}...
+        state = read_json(self.path)
+        if not state or state.get('failures', 0) < self.threshold:
+            # closed, no lock needed...
+            return None
+
+        def change(state):
+            now = time.time()
+            if state.get('failures', 0) < self.threshold:
+                return state, None
+            if now < state.get('until', 0):
+                return state, state
+            # half-open, this caller probes and the others wait it out...
+            state['until'] = now + self.window
+            return state, None
+        try:
+            return self._update(change)
+        except (ImportError, OSError):
+            return None
+
+    def failed(self, error):
+        def change(state):
+            state['failures'] = state.get('failures', 0) + 1
+            state['error'] = error
+            if state['failures'] >= self.threshold:
+                state['until'] = time.time() + self.window
+            return state, None
+        try:
+            self._update(change)
+        except (ImportError, OSError):
+            pass
+
+    def succeeded(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            self._update(lambda state: (None, None))
+        except (ImportError, OSError):
+            pass
+
+
+def breaker_dir(provider, alias=None):
+    # where the breakers of a provider (or one of its APIs) are kept...
+    path = cache_dir('failures', str(provider))
+    if alias is None:
+        return path
+    return os.path.join(path, str(alias).replace(os.sep, '_'))
+
+
+def reset(provider, alias=None):
+    # close the breakers of one API, or of a whole provider...
+    for directory, _, files in os.walk(breaker_dir(provider, alias)):
+        for name in files:
+            try:
+                os.unlink(os.path.join(directory, name))
+            except OSError:
+                pass
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+# Where cliapi keeps its state between invocations (provider manifest,
+# cloud detection, ...).  /run is cleared on every boot which is exactly
+# the lifetime we want for most of this data...
+CACHE_ENV = 'CLIAPI_CACHE_DIR'
+
+
+def cache_dir(*parts):
+    # return (and create) a directory below the cliapi cache root...
+    root = os.environ.get(CACHE_ENV)
+    if not root:
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            root = '/run/cliapi'
+        elif os.environ.get('XDG_RUNTIME_DIR'):
+            root = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'cliapi')
+        else:
+            root = os.path.join(os.path.expanduser('~'), '.cache', 'cliapi')
+    path = os.path.join(root, *parts)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def boot_id():
+    # a value which changes on every reboot of this host...
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def read_json(path):
+    # a missing or corrupt file is simply a cache miss...
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def atomic_write(path, data):
+    # write to a temp file in the same directory and rename over the
+    # target so concurrent readers never see a partial file...
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_json(path, obj):
+    atomic_write(path, json.dumps(obj, default=repr).encode('utf-8'))
+
+
+class ResultCache(object):
+    # Cross-invocation cache of fetcher results.
+    # Each entry is a small JSON file keyed by a digest of
+    # (provider, api alias, args, kwargs) and grouped in a directory
+    # per provider and API so an API can be invalidated as a whole.
+    # Documents get a binary snapshot next to their entry...
+
+    def __init__(self, root=None):
+        self.root = root
+
+    def _api_dir(self, provider, alias):
+        root = self.root or cache_dir('results')
+        return os.path.join(root, str(provider),
+                            str(alias).replace(os.sep, '_'))
+
+    @staticmethod
+    def digest(key):
+        text = json.dumps(key, sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self._api_dir(key[0], key[1]),
+                            self.digest(key) + '.json')
+
+    def snapshot_path(self, key):
+        return os.path.join(self._api_dir(key[0], key[1]),
+                            self.digest(key) + '.snap')
+
+    def index_path(self, key):
+        return os.path.join(self._api_dir(key[0], key[1]),
+                            self.digest(key) + '.paths')
+
+    def snapshot(self, key):
+        # a fresh snapshot (see cliapi.snapshot) of the value stored for
+        # this key, for looking up a part of it, or None...
+        from cliapi.snapshot import Snapshot
+        try:
+            snapshot = Snapshot(self.snapshot_path(key))
+        except (OSError, ValueError):
+            return None
+        if snapshot.expires <= time.time():
+            snapshot.close()
+            return None
+        return snapshot
+
+    def index(self, key):
+        # the fresh flattened index (see cliapi.index) of the value stored
+        # for this key, or None...
+        try:
+            saved = read_json(self.index_path(key))
+        except OSError:
+            return None
+        if saved is None or saved['expires'] <= time.time():
+            return None
+        return saved['leaves']
+
+    def lookup(self, key):
+        # the entry for this key, fresh or not, or None...
+        try:
+            entry = read_json(self.path(key))
+        except OSError:
+            return None
+        if entry is None or entry.get('key') != json.loads(
+                json.dumps(key, default=repr)):
+            return None
+        return entry
+
+    def get(self, key):
+        # the entry for this key when it has not expired yet, or None...
+        entry = self.lookup(key)
+        if entry is None or entry['expires'] <= time.time():
+            return None
+        return entry
+
+    def put(self, key, value, ttl):
+        now = time.time()
+        entry = {'key': key, 'stored': now, 'expires': now + ttl,
+                 'value': value}
+        try:
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            for derived in (self.snapshot_path(key), self.index_path(key)):
+                # made from the value being replaced, see put_snapshot()
+                # and put_index()...
+                try:
+                    os.unlink(derived)
+                except OSError:
+                    pass
+            atomic_write(path, json.dumps(entry).encode('utf-8'))
+        except (OSError, TypeError, ValueError):
+            # not cacheable or nowhere to put it, the result is still good...
+            pass
+        return entry
+
+    def put_snapshot(self, entry):
+        # save a stored document as a snapshot too, so a scoop can be
+        # answered without decoding all of it.  (Encoding a large document
+        # takes a while, it is done after the fetch released its flight()
+        # lock)...
+        if not isinstance(entry['value'], (dict, list)):
+            return
+        from cliapi import snapshot
+        try:
+            atomic_write(self.snapshot_path(entry['key']),
+                         snapshot.encode(entry['value'], entry['stored'],
+                                         entry['expires']))
+        except (OSError, TypeError, ValueError):
+            pass
+
+    def put_index(self, key, leaves):
+        # save the flattened index of the document stored for this key, as
+        # long as that has a fresh snapshot to take its expiry from...
+        snapshot = self.snapshot(key)
+        if snapshot is None:
+            return
+        expires = snapshot.expires
+        snapshot.close()
+        try:
+            atomic_write(self.index_path(key), json.dumps(
+                {'expires': expires, 'leaves': leaves}).encode('utf-8'))
+        except (OSError, TypeError, ValueError):
+            pass
+
+    def _lock_path(self, key, kind='lock'):
+        # (not next to the entries, invalidate() must never unlink a lock)
+        if self.root:
+            directory = os.path.join(self.root, '.locks')
+        else:
+            directory = cache_dir('locks')
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        return os.path.join(directory, self.digest(key) + '.' + kind)
+
+    @contextmanager
+    def flight(self, key):
+        # hold the lock of this key while its result is being fetched, so
+        # concurrent cliapi processes (and threads) wait for a single fetch
+        # and then reuse its entry instead of each fetching their own...
+        try:
+            import fcntl
+            fd = os.open(self._lock_path(key), os.O_RDWR | os.O_CREAT, 0o600)
+        except (ImportError, OSError):
+            # no locking here, every process fetches for itself...
+            yield
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # (closing releases the lock, also when the process dies)
+            os.close(fd)
+
+    def try_lock(self, key, kind):
+        # take a lock of this key without waiting, returns its file
+        # descriptor (closing it releases the lock) or None when another
+        # process (or thread) holds it...
+        try:
+            import fcntl
+            fd = os.open(self._lock_path(key, kind), os.O_RDWR | os.O_CREAT,
+                         0o600)
+        except (ImportError, OSError):
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def invalidate(self, provider, alias=None):
+        # drop every cached result of one API, or of a whole provider...
+        if alias is None:
+            target = os.path.dirname(self._api_dir(provider, '_'))
+        else:
+            target = self._api_dir(provider, alias)
+        for directory, _, files in os.walk(target):
+            for name in files:
+                try:
+                    os.unlink(os.path.join(directory, name))
+                except OSError:
+                    pass
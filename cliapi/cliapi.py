@@ -22,28 +22,9 @@ if 'PYCHARM_DEBUG_ME' in os.environ:
                     stderrToServer=True)
 
 import sys
-import importlib
-import pkgutil
 import getopt
-import json
 
-import cliapi.providers as providers
-from cliapi.cliapi_lib import Provider
-
-prefix = providers.__name__ + '.'
-
-# this will scan the "providers" directory for all candidate provider modules...
-all_providers = [mod for _, mod, _ in pkgutil.iter_modules(providers.__path__, prefix)]
-valid_providers = {}
-
-# import all valid providers found in the "providers" directory...
-for pro in all_providers:
-    module_name = pro.split('.')[-1]
-    try:
-        vp = importlib.import_module(pro)
-        valid_providers[module_name] = vp
-    except Exception as e:
-        pass
+from cliapi import daemon
 
 # TODO: does "xml-out" really need to be implemented in a modern Devops world???
 cli_options = ['help',
@@ -51,6 +32,9 @@ cli_options = ['help',
                'list-providers',
                "list-apis",
                'query=', 'all',
+               'no-cache', 'refresh', 'invalidate=',
+               'serve', 'no-daemon', 'batch=', 'output=', 'timings',
+               'watch=', 'diff', 'on-limit=', 'list-paths', 'find=',
                ]
                 # 'xml-out']
 
@@ -70,26 +54,42 @@ def _print_help(provider):
     # Help for Common CLI options...
     help = {
         'help': 'help for this CLI command',
-        'provider=': 'specify name of provider module',
+        'provider=': 'specify name of provider module (a,b or * for several)',
         'list-providers': 'list all available providers',
         'xml-out': 'output in xml format',
         'list-apis': 'list all available APIs for specified provider',
         'query=': 'specify a python dictionary style query command',
         'all': 'output all API results for specified API options or defaults',
+        'no-cache': 'neither use nor save cached API results',
+        'refresh': 'ignore cached API results, fetch and save new ones',
+        'invalidate=': 'drop cached results of these APIs (comma list or *)',
+        'serve': 'run as a daemon answering cliapi requests on a local socket',
+        'no-daemon': 'do not pass this request to a running cliapi daemon',
+        'batch=': 'answer one request per line of this file (- for stdin)',
+        'output=': 'pretty (default), compact, ndjson or raw (plain strings)',
+        'timings': 'trace where the time goes, to stderr or $CLIAPI_TIMINGS file',
+        'watch=': 'answer again every SECONDS, write only what changed',
+        'diff': 'with --watch, write changes as JSON Patch operations',
+        'on-limit=': 'when rate limited: block (wait) or stale (expired cache)',
+        'list-paths': 'list the query path and type of every value of all APIs',
+        'find=': 'the query paths and values whose key or value contains this',
     }
 
+    from cliapi import discover
+    from cliapi.cliapi_lib import Provider
+
     if provider == None:
         vpp = Provider()
         # no provider supplied so at least print out the "common" help...
         vpp.help = help
     else:
-        vpp = valid_providers[provider].provider
+        vpp = discover.load_provider(provider)
         # update help with options from this provider...
         vpp.help.update(help)
     required = list()
-    for fetcher in vpp.fetchers.items():
+    for plan in vpp.plans.values():
         # create a list of required options for fast lookup...
-        required += fetcher[1][1][0]
+        required += plan.required
     indent2_format = '  --{:<15}  {:<15}'
     print("usage: {} [display option#1]... [API option#1]... [CLI option]".format(sys.argv[0]))
     print("\n***[ {} ]*** provider Display options:".format(provider))
@@ -105,7 +105,7 @@ def _print_help(provider):
             if help != '':
                 # help message is provided by plugin provider...
                 help = ''.join((', ', help) )
-            if v in required:
+            if opt in required:
                 # if this option is required, then say so...
                 help = ''.join(('-REQUIRED-', help))
             elif opt in vpp.template:
@@ -122,135 +122,583 @@ def _print_help(provider):
 
 
 def _sandbox_eval(vpp, lookup):
-    return eval('vpp' + lookup,
-                {'__builtins__': None},
-                {'vpp': vpp})
+    # lookups are compiled (and cached), never eval()-ed...
+    from cliapi import scoop
+    return vpp.lookup(scoop.compile_query(lookup))
 
 
-def main():
-    # must do our own parsing here since we don't know the
-    # valid options until we establish the plugin provider
-    # -- getopt() does not allow this usage...
-    ct = _cli_parse(sys.argv[1:])
+def _path_of(vpp, key, query):
+    # the compiled lookup path of a scoop or query...
+    try:
+        return vpp.path(key, query)
+    except SyntaxError:
+        # reported when the query is evaluated...
+        return None
 
-    if '--list-providers' in ct:
-        print(json.dumps(list(valid_providers.keys()), indent=2))
-        exit(0)
 
-    cmd_dict = {}
+class UsageError(Exception):
+    # a request which cannot be answered; args[0] is the message and
+    # provider the provider whose help goes with it...
+    def __init__(self, message, provider=None):
+        super().__init__(message)
+        self.provider = provider
+
+
+def _select_provider(ct, valid_providers):
     if '--provider' in ct:
         # using supplied provider...
         provider = ct['--provider']
-    else:
+        if provider not in valid_providers:
+            raise UsageError('No such provider -- "{}"'.format(provider))
+        return provider
+    try:
+        # use the first valid provider in list...
+        return valid_providers[0]
+    except IndexError:
+        raise UsageError('No plugin providers found')
+
+
+def _provider_names(ct, valid_providers):
+    # the providers of a "--provider=a,b" or "--provider=*" request, in
+    # the order given (discovery order for *), or None for a request
+    # to a single provider...
+    value = ct.get('--provider')
+    if value is None or (',' not in value and value != '*'):
+        return None
+    if value == '*':
+        return list(valid_providers)
+    names = []
+    for name in value.split(','):
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def _known_options(vpp):
+    # the long options getopt accepts for this provider...
+    options = [v[1:] for v in vpp.options.values() if v.startswith('$')]
+    return set(vpp.scoops) | set(options) | \
+        set(option.rstrip('=') for option in cli_options)
+
+
+def _knows(known, arg):
+    # is this (possibly abbreviated) option one of known?
+    option = arg[2:].split('=')[0]
+    return any(name.startswith(option) for name in known)
+
+
+def _fan_out(argv, names, valid_providers):
+    # answer one request from several providers at once, their APIs are
+    # fetched concurrently.  Each provider is given only the options it
+    # knows and a provider failing does not fail the others.
+    # Returns {provider: future} in the order of names...
+    from concurrent.futures import Future, ThreadPoolExecutor
+    from cliapi import discover
+    from cliapi import timings
+
+    requests = {}
+    failed = {}
+    for name in names:
+        if name not in valid_providers:
+            failed[name] = UsageError('No such provider -- "{}"'.format(name),
+                                      name)
+            continue
         try:
-            # use the first valid provider in list...
-            provider = list(valid_providers.keys())[0]
+            vpp = discover.load_provider(name)
         except Exception as e:
-            # error -- print help and exit
-            print('No plugin providers found')
-            _print_help(None)
-            exit(-1)
+            failed[name] = e
+            continue
+        requests[name] = vpp
 
-    vpp = valid_providers[provider].provider
-    all_opts = list(vpp.scoops.keys())
-    options = []
-    for k, v in vpp.options.items(): # process args...
-        if v.startswith('$'):
-            options.append(v[1:] + '=')
-    all_opts += options
+    known = {name: _known_options(vpp) for name, vpp in requests.items()}
+    for arg in argv:
+        if arg.startswith('--') and known and \
+                not any(_knows(k, arg) for k in known.values()):
+            raise UsageError('option {} not recognized'.format(
+                arg.split('=')[0]))
+
+    jobs = {}
+    for name, vpp in requests.items():
+        own = [arg for arg in argv
+               if not arg.startswith('--') or _knows(known[name], arg)]
+        try:
+            cmd_dict, wanted = _parse(vpp, name, own)
+            _configure(vpp, cmd_dict)
+        except UsageError as e:
+            failed[name] = e
+            continue
+        if wanted or cmd_dict.keys() & {'all', 'list-apis', 'list-paths',
+                                        'find'}:
+            # (a provider with nothing asked of it is left out)
+            jobs[name] = (vpp, cmd_dict, wanted)
+
+    def answer(name):
+        vpp, cmd_dict, wanted = jobs[name]
+        with timings.span('provider ' + name):
+            if 'list-apis' in cmd_dict:
+                return list(vpp.fetchers)
+            if 'list-paths' in cmd_dict or 'find' in cmd_dict:
+                return _collect_paths(vpp, name, cmd_dict)
+            if 'all' in cmd_dict:
+                return _collect_all(vpp, name)
+            return _collect(vpp, name, wanted)
+
+    futures = {}
+    pool = ThreadPoolExecutor(max_workers=max(len(jobs), 1))
+    for name in names:
+        if name in jobs:
+            futures[name] = pool.submit(timings.bind(answer), name)
+        elif name in failed:
+            futures[name] = Future()
+            futures[name].set_exception(failed[name])
+    pool.shutdown(wait=False)
+    return futures
+
+
+def _result_of(future):
+    # a provider's answer, or its error...
+    try:
+        return future.result()
+    except UsageError as e:
+        return {'error': e.args[0]}
+    except Exception as e:
+        # e.g. the plugin failed to import...
+        return {'error': str(e) or repr(e)}
 
-    # add "plugin cli_options" to the "common" CLI options...
-    all_opts += cli_options
 
+def _parse(vpp, provider, argv):
+    # now we have enough info to use getopt() for cli parsing...
+    # returns the dictionary of the actual supplied CLI options and the
+    # requested (option, query) pairs in option order
+    from cliapi.timings import span
+
+    options = [v[1:] + '=' for v in vpp.options.values() if v.startswith('$')]
+    all_opts = list(vpp.scoops.keys()) + options + cli_options
     try:
-        # now we have enough info to use getopt() for cli parsing...
-        optlist, arg = getopt.gnu_getopt(sys.argv[1:], '', all_opts)
+        with span('getopt'):
+            optlist, arg = getopt.gnu_getopt(argv, '', all_opts)
     except getopt.GetoptError as e:
-        # error -- print help and exit
-        print(e.msg)
-        cmd_dict['help'] = None
+        raise UsageError(e.msg, provider)
+    cmd_dict = {}
+    wanted = []
+    for opt, value in optlist:
+        key = opt[2:]
+        cmd_dict[key] = value
+        if key in vpp.scoops:
+            wanted.append((key, vpp.scoops[key]))
+        elif key == 'query':
+            wanted.append((key, value))
+        # Not a scoop or a query?
+        # then ignore option, continue processing...
+    return cmd_dict, wanted
+
+
+# set in the daemon, whose providers outlive a request...
+_serving = False
+
+
+def _configure(vpp, cmd_dict):
+    # apply the API options, this provider may be serving many requests...
+    vpp.configure(cmd_dict)
+    if _serving:
+        vpp.forget_uncached()
+    if 'no-cache' in cmd_dict:
+        vpp.cache_mode = 'off'
+    elif 'refresh' in cmd_dict:
+        vpp.cache_mode = 'refresh'
+        vpp.forget()
+    if 'on-limit' in cmd_dict:
+        if cmd_dict['on-limit'] not in ('block', 'stale'):
+            raise UsageError('bad on-limit -- "{}", block or stale'.format(
+                cmd_dict['on-limit']), vpp.name)
+        vpp.on_limit = cmd_dict['on-limit']
+    if 'invalidate' in cmd_dict:
+        for alias in cmd_dict['invalidate'].split(','):
+            vpp.invalidate(None if alias == '*' else alias)
+
+
+def _check(vpp, provider, aliases):
+    # report a missing required option before anything is fetched...
+    try:
+        vpp.check(aliases)
+    except AssertionError as e:
+        raise UsageError(e.args[0], provider)
+
+
+def _collect_all(vpp, provider):
+    # return a composite dictionary of all API calls...
+    _check(vpp, provider, vpp.fetchers)
+    vpp.prefetch(vpp.fetchers)
+    results = {}
+    for fetch in vpp.fetchers:
+        # must populate dictionary by walking the top-level API...
+        try:
+            results[fetch] = vpp[fetch]
+        except Exception as e:
+            # error caused by plugin developer...
+            raise UsageError(e.args[0] if e.args else repr(e), provider)
+    # return all the API results in option order (the provider holds
+    # them in the order the parallel fetches completed)...
+    return results
+
+
+def _stream_all(vpp, provider, mode):
+    # write a composite dictionary of all API calls.  With ndjson and raw
+    # output each API is written as soon as it (and the ones before it)
+    # have been fetched, a single JSON document is only written once every
+    # API succeeded so a failing API never leaves half a document behind...
+    from cliapi import output
+
+    if mode not in ('ndjson', 'raw'):
+        results = _collect_all(vpp, provider)
+        output.write_mapping(list(results), results.get, mode, sys.stdout)
+        return
+
+    _check(vpp, provider, vpp.fetchers)
+    futures = vpp.prefetch(vpp.fetchers, wait=False)
+
+    def resolve(fetch):
+        if fetch in futures:
+            # wait for the background fetch, its error is raised below...
+            futures[fetch].exception()
+        try:
+            return vpp[fetch]
+        except Exception as e:
+            # error caused by plugin developer...
+            raise UsageError(e.args[0] if e.args else repr(e), provider)
+
+    output.write_mapping(list(vpp.fetchers), resolve, mode, sys.stdout)
+
+
+def _collect_paths(vpp, provider, cmd_dict):
+    # the flattened index of all API results, {query: type} for
+    # --list-paths or the {query: value} matching --find=...
+    from cliapi import index
+
+    _check(vpp, provider, vpp.fetchers)
+    errors = {}
+    indexes = vpp.index(list(vpp.fetchers), errors)
+    for alias, e in errors.items():
+        # e.g. an API only root may read, the others are still listed...
+        sys.stderr.write('{}: {} (skipped)\n'.format(
+            provider, e.args[0] if e.args else repr(e)))
+    leaves = [leaf for alias in indexes for leaf in indexes[alias]]
+    if 'find' in cmd_dict:
+        return dict(index.find(leaves, cmd_dict['find']))
+    return {query: index.type_of(value) for query, value in leaves}
+
+
+def _collect(vpp, provider, wanted, unwrap=True):
+    # return all specified "data scoops"...
+    from cliapi.timings import span
+    from cliapi import scoop
+
+    # fetch every API (or API subtree) behind the requested scoops at once...
+    paths = [_path_of(vpp, key, query) for key, query in wanted]
+    _check(vpp, provider, [scoop.api_of(path) for path in paths
+                           if path is not None])
+    with span('prefetch'):
+        vpp.prefetch([path for path in paths if path is not None])
+
+    data = []
+    for key, query in wanted:
+        try:
+            # accumulate all requested scoops
+            with span('lookup', option=key):
+                data.append(vpp.lookup(vpp.path(key, query)))
+        except KeyError as e:
+            if key == 'query':
+                # a bogus CLI option was input by user...
+                message = 'bad query -- "{}", no such item'.format(query)
+            else:
+                # a bogus scoop option was specified by plugin developer...
+                message = 'option {} -- "{}", bad plugin query'.format(key, query)
+        except AssertionError as e:
+            # a required option is missing...
+            message = e.args[0]
+        except SyntaxError as e:
+            # a syntax error detected in query...
+            message = 'error in query -- "{}" syntax error'.format(query)
+        else:
+            # no errors, continue processing...
+            continue
+        raise UsageError(message, provider)
+
+    if unwrap and len(data) == 1:
+        # a single value was returned so no list is returned...
+        data = data[0]
+    return data
+
+
+def _watch(vpp, provider, cmd_dict, wanted, mode):
+    # answer this request again and again, re-fetching only the APIs
+    # behind it.  Results of the cross-invocation cache are not reused
+    # (but still saved), HTTP APIs revalidate with their ETags and file
+    # backed APIs are only read again when one of their files changed...
+    from cliapi import output
+    from cliapi import scoop
+    from cliapi import watch
+
+    try:
+        interval = float(cmd_dict['watch'])
+    except ValueError:
+        interval = -1
+    if interval <= 0:
+        raise UsageError('bad watch interval -- "{}"'.format(
+            cmd_dict['watch']), provider)
+    if 'all' in cmd_dict:
+        aliases = list(vpp.fetchers)
+    else:
+        paths = [_path_of(vpp, key, query) for key, query in wanted]
+        aliases = [scoop.api_of(path) for path in paths if path is not None]
+    aliases = vpp.dependencies(aliases)
+    # a missing required option is still a usage error...
+    _check(vpp, provider, aliases)
+    if vpp.cache_mode == 'use':
+        vpp.cache_mode = 'refresh'
+    vpp.forget()
+
+    def answer():
+        for alias in aliases:
+            if alias in vpp.versions and \
+                    vpp.versions[alias] == vpp._versions(alias):
+                # file backed and its files are unchanged, not read again...
+                continue
+            vpp.forget(alias)
+        try:
+            if 'all' in cmd_dict:
+                return _collect_all(vpp, provider)
+            return _collect(vpp, provider, wanted)
+        except UsageError as e:
+            # e.g. the API is down or the value is gone, keep watching...
+            return {'error': e.args[0]}
+
+    def write(value):
+        output.write(value, mode, sys.stdout)
+        sys.stdout.flush()
+
+    watch.watch(answer, interval, write, patches='diff' in cmd_dict)
+
+
+# options of a request which make no sense for one line of --batch...
+BATCH_UNSUPPORTED = ('--help', '--watch', '--diff', '--serve', '--batch')
+
+
+def _answer(argv, valid_providers):
+    # answer one request without printing anything...
+    from cliapi import discover
+
+    ct = _cli_parse(argv)
+    for option in BATCH_UNSUPPORTED:
+        if option in ct:
+            raise UsageError('option {} not supported in batch mode'.format(
+                option))
+    if '--list-providers' in ct:
+        return valid_providers
+    names = _provider_names(ct, valid_providers)
+    if names is not None:
+        futures = _fan_out(argv, names, valid_providers)
+        return {name: _result_of(future) for name, future in futures.items()}
+    provider = _select_provider(ct, valid_providers)
+    vpp = discover.load_provider(provider)
+    cmd_dict, wanted = _parse(vpp, provider, argv)
+    _configure(vpp, cmd_dict)
+    if 'list-apis' in cmd_dict:
+        return list(vpp.fetchers)
+    if 'list-paths' in cmd_dict or 'find' in cmd_dict:
+        return _collect_paths(vpp, provider, cmd_dict)
+    if 'all' in cmd_dict:
+        return _collect_all(vpp, provider)
+    return _collect(vpp, provider, wanted)
+
+
+def _batch_argv(line):
+    # each line is a request: CLI options ("--location --provider=test"),
+    # bare scoop names ("location") or a query ("['meta_data']['compute']")
+    import shlex
+    if line.startswith('['):
+        return ['--query=' + line]
+    return [arg if arg.startswith('-') else '--' + arg
+            for arg in shlex.split(line)]
+
+
+def _batch(argv, valid_providers, source):
+    # answer every line of source, the options given along with --batch
+    # apply to every line and lines may override them...
+    from cliapi import output
+
+    base = [arg for arg in argv if not arg.startswith('--batch')]
+    for line in source:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            result = _answer(base + _batch_argv(line), valid_providers)
+        except UsageError as e:
+            result = {'error': e.args[0]}
+        except ValueError as e:
+            # e.g. unbalanced quotes on this line...
+            result = {'error': str(e)}
+        sys.stdout.write(output.dumps(result) + '\n')
+        sys.stdout.flush()
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    ct = _cli_parse(argv)
+
+    if '--serve' in ct:
+        # keep providers and their results warm between requests...
+        global _serving
+        _serving = True
+        from cliapi import discover
+        from cliapi import refresh
+        discover.current_manifest()
+        refresh.use_threads()
+        daemon.serve(run)
+        exit(0)
+
+    # (CLIAPI_TIMINGS is read by the process running the request, the
+    # daemon would neither see it nor write the trace where asked)
+    if not ct.keys() & {'--no-daemon', '--batch', '--watch'} and \
+            not os.environ.get('CLIAPI_TIMINGS'):
+        # let a running daemon answer, if there is one...
+        response = daemon.request(argv)
+        if response is not None:
+            sys.stdout.write(response['stdout'])
+            sys.stderr.write(response['stderr'])
+            exit(response['status'])
+
+    run(argv)
+
+
+def run(argv):
+    # the framework is imported only when the request is run in-process...
+    from cliapi import timings
+
+    trace, target = timings.requested(argv)
+    if not trace:
+        return _run(argv)
+    timings.start(target, argv=list(argv))
+    try:
+        return _run(argv)
+    finally:
+        timings.stop()
+
+
+def _run(argv):
+    from cliapi import discover
+    from cliapi import output
+    from cliapi.timings import span
+
+    # must do our own parsing here since we don't know the
+    # valid options until we establish the plugin provider
+    # -- getopt() does not allow this usage...
+    ct = _cli_parse(argv)
+
+    # only the manifest is needed to know which providers exist
+    # (the daemon keeps it in memory)...
+    if _serving:
+        manifest = discover.current_manifest()
     else:
-        # build a dictionary of the actual supplied CLI options...
-        for opt in optlist:
-            cmd_dict[opt[0][2:]] = opt[1]
-
-        vpp.template.update(cmd_dict)
-
-        # use defaults if option NOT supplied in CLI...
-        for default in options:
-            ds = default.split('=')
-            try:
-                if not cmd_dict.get(ds[0]):
-                    # override with default...
-                    cmd_dict[ds[0]] = ds[1]
-            except:
-                # no option to override or none specified -- ignore this...
-                pass
+        manifest = discover.load_manifest()
+    valid_providers = discover.valid_providers(manifest)
+
+    # (--watch writes a line per change unless told otherwise)
+    mode = ct.get('--output') or ('compact' if '--watch' in ct else 'pretty')
+    if mode not in output.MODES:
+        print('bad output mode -- "{}"'.format(mode))
+        _print_help(None)
+
+    if '--list-providers' in ct:
+        output.write(valid_providers, mode, sys.stdout)
+        exit(0)
+
+    if '--batch' in ct:
+        # many requests, one JSON result per line...
+        source = ct['--batch']
+        if source in (None, '-'):
+            _batch(argv, valid_providers, sys.stdin)
+        else:
+            with open(source) as f:
+                _batch(argv, valid_providers, f)
+        exit(0)
+
+    names = _provider_names(ct, valid_providers)
+    if names is not None:
+        # several providers, answered as {provider: result}...
+        if '--help' in ct:
+            _print_help(None)
+        if '--watch' in ct:
+            print('option --watch needs a single provider')
+            _print_help(None)
+        try:
+            futures = _fan_out(argv, names, valid_providers)
+        except UsageError as e:
+            print(e.args[0])
+            _print_help(None)
+        with span('output', mode=mode):
+            output.write_mapping(list(futures),
+                                 lambda name: _result_of(futures[name]),
+                                 mode, sys.stdout)
+        exit(0)
+
+    try:
+        provider = _select_provider(ct, valid_providers)
+    except UsageError as e:
+        # error -- print help and exit
+        print(e.args[0])
+        _print_help(None)
+
+    # ...and only the selected provider is ever imported
+    vpp = discover.load_provider(provider)
+    try:
+        cmd_dict, wanted = _parse(vpp, provider, argv)
+    except UsageError as e:
+        # error -- print help and exit
+        print(e.args[0])
+        _print_help(provider)
 
     if 'help' in cmd_dict:
         _print_help(provider)
         exit(0)
 
+    try:
+        _configure(vpp, cmd_dict)
+    except UsageError as e:
+        print(e.args[0])
+        _print_help(provider)
+
     if 'list-apis' in cmd_dict:
-        print(json.dumps(list(vpp.fetchers.keys()), indent=2))
+        output.write(list(vpp.fetchers.keys()), mode, sys.stdout)
         exit(0)
 
-    if 'all' in cmd_dict:
-        # return a composite dictionary of all API calls...
-        for fetch in vpp.fetchers:
-            # prefetch all the APIs...
-            scoop = "['" + fetch + "']"
-            # must populate dictionary by walking the top-level API...
-            try:
-                query = _sandbox_eval(vpp, scoop)
-            except Exception as e:
-                # error caused by plugin developer...
-                print(e.args[0])
-                _print_help(provider)
-                exit(-1)
-        # return all the API results from dictionary...
-        data = vpp
-
-    else:
-        data = []
-        for key, value in cmd_dict.items():
-            # return all specified "data scoops"...
-            if key in vpp.scoops:
-                query = vpp.scoops[key]
-            elif key == 'query':
-                query = cmd_dict['query']
-            else:
-                # Not a scoop or a query?
-                # then ignore option, continue processing...
-                continue
-            try:
-                # accumulate all requested scoops
-                data.append(_sandbox_eval(vpp, query))
-            except KeyError as e:
-                # error -- print help and exit
-                if key == 'query':
-                    # a bogus CLI option was input by user...
-                    print(('bad query -- "{}", no such item').format(query))
-                else:
-                    # a bogus scoop option was specified by plugin developer...
-                    print(('option {} -- "{}", bad plugin query').format(key, query))
-            except AssertionError as e:
-                # a required option is missing...
-                print(e.args[0])
-            except SyntaxError as e:
-                # a syntax error detected in query...
-                print('error in query -- "{}" syntax error'.format(query))
-            else:
-                # no errors, continue processing...
-                continue
-            # must have encountered an error, print help and abort...
+    if 'watch' in cmd_dict:
+        try:
+            _watch(vpp, provider, cmd_dict, wanted, mode)
+        except UsageError as e:
+            print(e.args[0])
             _print_help(provider)
+        exit(0)
 
-        if len(data) == 1:
-            # a single value was returned so no list is returned...
-            data = data[0]
-
-    print(json.dumps(data, indent=2))
+    try:
+        if 'list-paths' in cmd_dict or 'find' in cmd_dict:
+            with span('paths', output=mode):
+                found = _collect_paths(vpp, provider, cmd_dict)
+                output.write_mapping(list(found), found.get, mode,
+                                     sys.stdout)
+        elif 'all' in cmd_dict:
+            with span('all', output=mode):
+                _stream_all(vpp, provider, mode)
+        else:
+            data = _collect(vpp, provider, wanted, unwrap=False)
+            with span('output', mode=mode):
+                output.write_results(data, mode, sys.stdout)
+    except UsageError as e:
+        # must have encountered an error, print help and abort...
+        print(e.args[0])
+        _print_help(provider)
 
 
 if __name__ == '__main__':
@@ -1,7 +1,160 @@
+import os
+import re
+import time
 import inspect
-import importlib
 from string import Template
 
+from cliapi.cache import ResultCache
+from cliapi.ratelimit import TokenBucket
+from cliapi import breaker
+from cliapi import files as backing_files
+from cliapi import scoop
+from cliapi import timings
+# plugins add their own spans to --timings with span(name, **attrs)...
+from cliapi.timings import span
+# ...and parse the files of file backed APIs with xml_first(path, element)
+from cliapi.files import xml_first
+
+
+def __getattr__(name):
+    # the shared HTTP transport is re-exported here for the plugins but only
+    # imported by the ones which use it...
+    if name in ('HttpClient', 'HttpError', 'http_client'):
+        from cliapi import transport
+        return getattr(transport, name)
+    raise AttributeError(name)
+
+
+# Errors of the framework, they subclass the exceptions it raised
+# before so existing callers (and the CLI) keep working...
+
+class CliapiError(Exception):
+    pass
+
+
+class NoSuchProvider(CliapiError, LookupError):
+    pass
+
+
+class NoSuchItem(CliapiError, KeyError):
+    # a scoop or query into data which does not exist...
+    def __str__(self):
+        return str(self.args[0]) if self.args else ''
+
+
+class QuerySyntaxError(CliapiError, SyntaxError):
+    pass
+
+
+class BadOption(CliapiError, ValueError):
+    pass
+
+
+class MissingOption(CliapiError, AssertionError):
+    pass
+
+
+class FetchError(CliapiError, AssertionError):
+    # an API failed, args[0] is "<api> -- <error>"...
+    pass
+
+
+# a fetcher argument which is exactly one CLI option, "$name" or "${name}"...
+_option = re.compile(r'\$(?:(\w+)|\{(\w+)\})$')
+
+# how long results of file backed APIs are cached by default, they are
+# only reused while the files are unchanged anyway...
+FILE_TTL = 86400
+
+
+class CallPlan(object):
+    # How to call one API fetcher, resolved once by cliapi_compile() so a
+    # fault-in only has to look up the CLI option values:
+    #  - function, the plugin function itself
+    #  - args/kwargs, each argument is bound to a constant, a CLI option,
+    #    or (rarely) a template mixing both
+    #  - required, the CLI options bound to positional arguments
+    #  - depends, (parameter, alias, position) of each API whose result
+    #    is passed in, position is None for a keyword parameter
+
+    CONSTANT, OPTION, TEMPLATE = range(3)
+
+    def __init__(self, function, args, kwargs, depends=()):
+        self.function = function
+        self.depends = list(depends)
+        self.args = [self._binding(arg) for arg in args]
+        self.kwargs = [(key, self._binding(value))
+                       for key, value in kwargs.items()]
+        self.options = [value for kind, value in
+                        self.args + [b for _, b in self.kwargs]
+                        if kind == self.OPTION]
+        self.required = [value for kind, value in self.args
+                         if kind == self.OPTION]
+
+    @classmethod
+    def _binding(cls, value):
+        if not isinstance(value, str) or '$' not in value:
+            return cls.CONSTANT, value
+        match = _option.match(value)
+        if match:
+            return cls.OPTION, match.group(1) or match.group(2)
+        return cls.TEMPLATE, Template(value)
+
+    def missing(self, template):
+        # the CLI options this API needs but were not given...
+        return [option for option in self.options if option not in template]
+
+    def _value(self, binding, template):
+        kind, value = binding
+        if kind == self.OPTION:
+            return template[value]
+        if kind == self.TEMPLATE:
+            return value.substitute(template)
+        return value
+
+    def bind(self, template):
+        # the (args, kwargs) to call the fetcher with...
+        try:
+            args = [self._value(binding, template) for binding in self.args]
+            kwargs = {key: self._value(binding, template)
+                      for key, binding in self.kwargs}
+        except KeyError as e:
+            raise MissingOption('required option {}, missing'.format(e))
+        return args, kwargs
+
+    def with_upstream(self, values):
+        # the fetcher with the results of the APIs it depends on
+        # ({alias: result}) filled in...
+        def call(*args, **kwargs):
+            args = list(args)
+            for param, alias, position in self.depends:
+                if position is None:
+                    kwargs[param] = values[alias]
+                else:
+                    args.insert(position, values[alias])
+            return self.function(*args, **kwargs)
+        return call
+
+
+def _cycle(plans, alias):
+    # a chain of dependencies leading from alias back to itself, or None...
+    stack = [(alias, [alias])]
+    seen = set()
+    while stack:
+        current, chain = stack.pop()
+        plan = plans.get(current)
+        if plan is None:
+            # not compiled (yet)...
+            continue
+        for _, upstream, _ in plan.depends:
+            if upstream == alias:
+                return chain + [upstream]
+            if upstream not in seen:
+                seen.add(upstream)
+                stack.append((upstream, chain + [upstream]))
+    return None
+
+
 class Provider(dict):
     # The Provider class overrides Python's dictionary with
     # an API-backing-store.
@@ -12,54 +165,621 @@ class Provider(dict):
     # are also assembled in this class...
 
     def __init__(self):
+        self.name = None
         self.fetchers = {}
+        # the CallPlan of each fetcher...
+        self.plans = {}
         self.scoops = {}
+        # scoops compiled into lookup paths, see cliapi.scoop...
+        self.paths = {}
         self.options = {}
         self.help = {}
         self.template = {}
+        # the template as assembled by cliapi_compile(), see configure()...
+        self.defaults = None
+        # per API settings given to cliapi_compile(), e.g. {'ttl': 60}...
+        self.policies = {}
+        # results are shared across invocations through this cache,
+        # cache_mode is one of 'use', 'refresh' (fetch and save) or 'off'...
+        self.cache = ResultCache()
+        self.cache_mode = 'use'
+        # errors raised by APIs fetched in the background by prefetch()...
+        self.failures = {}
+        # when each API (or (alias, subpath) of a pushdown) was faulted-in
+        # (time.monotonic())...
+        self.fetched = {}
+        # hooks fetching only a subtree of an API, and the subtrees they
+        # fetched as {alias: {subpath: value}}...
+        self.pushdowns = {}
+        self.partials = {}
+        # the token buckets of rate limited APIs, by rate_key, and what to
+        # do when one is empty ('block' or 'stale'), None for the API's own
+        # choice...
+        self.buckets = {}
+        self.on_limit = None
+        # fresh cached snapshots of APIs not fetched in this process,
+        # scoops are answered from them without decoding the rest...
+        self.snapshots = {}
+        # the versions of the files read by the file backed APIs fetched
+        # in this process, see cliapi.files...
+        self.versions = {}
+        # APIs answered with an expired result (see max_stale), the next
+        # request asks again...
+        self.stale = set()
+        # the results this process put in the cache, by key digest, and
+        # when they expire there (see _save())...
+        self.saved = {}
 
         return super().__init__({})
 
+    def configure(self, cmd_dict):
+        # apply the CLI options of one request.
+        # A provider may serve many requests (see cliapi.daemon) so results
+        # fetched with other option values, or older than their ttl,
+        # are forgotten...
+        if self.defaults is None:
+            self.defaults = dict(self.template)
+        names = set(v[1:] for v in self.options.values()
+                    if isinstance(v, str) and v.startswith('$'))
+        template = dict(self.defaults)
+        template.update((k, v) for k, v in cmd_dict.items() if k in names)
+        if template != self.template:
+            self.template = template
+            self.forget()
+        for alias in list(self.stale):
+            self.forget(alias)
+        now = time.monotonic()
+        for job, fetched in list(self.fetched.items()):
+            if isinstance(job, tuple):
+                # a subtree fetched through the pushdown hook...
+                alias, subpath = job
+                ttl = self.policies.get(alias, {}).get('ttl')
+                if ttl and now - fetched >= ttl:
+                    self.partials.get(alias, {}).pop(subpath, None)
+                    self.fetched.pop(job, None)
+                continue
+            alias = job
+            ttl = self.policies.get(alias, {}).get('ttl')
+            if ttl and now - fetched >= ttl:
+                self.forget(alias)
+            elif alias in self.versions and \
+                    self.versions[alias] != self._versions(alias):
+                # a file it was read from has changed...
+                self.forget(alias)
+        self.cache_mode = 'use'
+        self.on_limit = None
+
+    def forget_uncached(self):
+        # forget the results of APIs which are not cached (no ttl), for a
+        # provider answering many requests (the daemon, cliapi.query()):
+        # they are fetched again for every request, like by a cliapi
+        # command.  (APIs derived from others go along with them)
+        for job in list(self.fetched):
+            alias = job[0] if isinstance(job, tuple) else job
+            if not self.policies.get(alias, {}).get('ttl') and \
+                    alias in self.plans and not self.plans[alias].depends:
+                # (subtrees fetched through the pushdown hook as well)
+                self.forget(alias)
+
+    def prefetch(self, wanted, wait=True):
+        # fault-in several APIs concurrently on a thread pool.
+        # wanted holds API aliases or compiled lookup paths, paths into
+        # an API with a pushdown hook only fetch the subtree they need.
+        # Errors are kept and raised again by the next lookup of that API
+        # so callers still see them in their own (option) order.
+        # Returns {alias or (alias, subpath): future} for what was fetched...
+        # APIs which depend on others are scheduled after them and
+        # independent ones run in parallel...
+        jobs = {}
+        aliases = []
+        partial = []
+        for want in wanted:
+            if isinstance(want, tuple):
+                if len(want) > 1 and want[0] not in self and \
+                        self._snapshot(want[0]) is not None:
+                    # answered by lookup() from the cached snapshot...
+                    continue
+                if self._pushed_down(want):
+                    partial.append(want)
+                    continue
+                want = scoop.api_of(want)
+            aliases.append(want)
+        # two or more subtrees of one API cost more requests than the whole
+        # API (and its rate limit), it is fetched once instead...
+        subpaths = {}
+        for want in partial:
+            subpath = scoop.literal(want)[1:]
+            if subpath not in self.partials.get(want[0], {}):
+                subpaths.setdefault(want[0], set()).add(subpath)
+        for alias, wanted_paths in subpaths.items():
+            if len(wanted_paths) > 1:
+                aliases.append(alias)
+        for alias in self.dependencies(aliases):
+            if alias in self.fetchers and alias not in self:
+                jobs[alias] = None
+        for want in partial:
+            alias = scoop.api_of(want)
+            subpath = scoop.literal(want)[1:]
+            if alias not in jobs and \
+                    subpath not in self.partials.get(alias, {}):
+                # (no subtree is fetched of an API fetched as a whole)
+                jobs[(alias, subpath)] = None
+        if not jobs:
+            return {}
+        futures = {}
+
+        def fault_in(job):
+            # (runs on a pool thread, bound to the caller's --timings span)
+            try:
+                if isinstance(job, tuple):
+                    return self._partial(*job)
+                for _, upstream, _ in self.plans[job].depends:
+                    if upstream in futures:
+                        # submitted before this job, wait for it...
+                        futures[upstream].exception()
+                return self[job]
+            except Exception as e:
+                self.failures[job] = e
+                raise
+
+        # imported here, a thread pool is not needed by every invocation...
+        from concurrent.futures import ThreadPoolExecutor
+        # (a thread per job, so waiting on upstream jobs can not starve them)
+        pool = ThreadPoolExecutor(max_workers=len(jobs))
+        for job in jobs:
+            futures[job] = pool.submit(timings.bind(fault_in), job)
+        pool.shutdown(wait=wait)
+        return futures
+
+    def dependencies(self, aliases):
+        # these APIs and the ones they depend on, each listed after
+        # its dependencies...
+        ordered = []
+
+        def visit(alias):
+            if alias in ordered:
+                return
+            plan = self.plans.get(alias)
+            if plan is not None:
+                for _, upstream, _ in plan.depends:
+                    visit(upstream)
+            ordered.append(alias)
+        for alias in aliases:
+            visit(alias)
+        return ordered
+
+    def check(self, aliases):
+        # raise MissingOption, before anything is fetched, when a
+        # required option of one of these APIs is missing...
+        for alias in self.dependencies(aliases):
+            plan = self.plans.get(alias)
+            if plan is None:
+                continue
+            missing = plan.missing(self.template)
+            if missing:
+                raise MissingOption(
+                    'required option {!r}, missing'.format(missing[0]))
+
+    def _pushed_down(self, path):
+        # can this path be answered by fetching only a subtree of its API?
+        # (only the keys and indexes up to a selector are pushed down, and
+        # not negative indexes, which the endpoints do not know)
+        alias = scoop.api_of(path)
+        prefix = scoop.literal(path)
+        return len(prefix) > 1 and alias in self.pushdowns and \
+            alias not in self and \
+            not any(isinstance(key, int) and key < 0 for key in prefix)
+
+    def _partial(self, alias, subpath):
+        # the subtree at subpath of an API, fetched through its pushdown hook
+        # unless a fetched subtree already contains it...
+        partials = self.partials.setdefault(alias, {})
+        for i in range(len(subpath), 0, -1):
+            if subpath[:i] in partials:
+                return scoop.lookup(partials[subpath[:i]], subpath[i:])
+        if (alias, subpath) in self.failures:
+            # it already failed in the background...
+            raise self.failures.pop((alias, subpath))
+        args, kwargs = self._arguments(alias)
+        try:
+            with span('pushdown ' + alias, path=list(subpath)):
+                value = self._fetch(alias, self.pushdowns[alias],
+                                    [list(subpath)] + args, kwargs)
+        except KeyError:
+            # no such item...
+            raise
+        except Exception as e:
+            raise FetchError('{} -- {}'.format(alias, e))
+        partials[subpath] = value
+        self.fetched[(alias, subpath)] = time.monotonic()
+        return value
+
+    def lookup(self, path):
+        # walk a compiled path (see cliapi.scoop) over this provider...
+        if len(path) > 1 and path[0] not in self:
+            snapshot = self._snapshot(path[0])
+            if snapshot is not None:
+                timings.annotate(snapshot=path[0])
+                return snapshot.lookup(path[1:])
+        if self._pushed_down(path):
+            prefix = scoop.literal(path)
+            value = self._partial(path[0], prefix[1:])
+            return scoop.lookup(value, path[len(prefix):])
+        return scoop.lookup(self, path)
+
+    def _cached(self, alias):
+        # can the cached result of an API be read without fetching it?
+        # (not the ones derived from other APIs, their key depends on
+        # the upstream results)
+        policy = self.policies.get(alias, {})
+        return self.cache_mode == 'use' and policy.get('ttl') and \
+            alias not in self.failures and alias in self.plans and \
+            not self.plans[alias].depends
+
+    def _snapshot(self, alias):
+        # the fresh cached snapshot of an API, or None...
+        if not self._cached(alias):
+            return None
+        snapshot = self.snapshots.get(alias)
+        if snapshot is not None and snapshot.expires > time.time() and \
+                self.versions.get(alias) == self._versions(alias):
+            return snapshot
+        try:
+            key = self._key(alias, *self._arguments(alias))
+        except MissingOption:
+            # reported when it is fetched...
+            return None
+        snapshot = self.snapshots[alias] = self.cache.snapshot(key)
+        return snapshot
+
+    def index(self, aliases, errors=None):
+        # the flattened leaves of these APIs' results (see cliapi.index) as
+        # {alias: [[query, value], ...]}, from the cache when fresh there,
+        # otherwise the APIs are fetched (in parallel).  Given an errors
+        # dictionary, APIs which fail are left out and their errors kept
+        # there instead of being raised...
+        # (an index is only built, and saved along with the cached result,
+        # the first time it is asked for)
+        from cliapi import index
+        leaves = {}
+        keys = {}
+        for alias in aliases:
+            if not self._cached(alias):
+                continue
+            try:
+                keys[alias] = self._key(alias, *self._arguments(alias))
+            except MissingOption:
+                continue
+            if alias not in self:
+                cached = self.cache.index(keys[alias])
+                if cached is not None:
+                    leaves[alias] = cached
+        missing = [alias for alias in aliases if alias not in leaves]
+        self.prefetch(missing)
+        for alias in missing:
+            try:
+                value = self[alias]
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors[alias] = e
+                continue
+            leaves[alias] = index.flatten(alias, value)
+            if alias in keys:
+                self.cache.put_index(keys[alias], leaves[alias])
+        return {alias: leaves[alias] for alias in aliases if alias in leaves}
+
+    def path(self, name=None, query=None):
+        # the compiled lookup path of a scoop or of an ad-hoc query...
+        if name in self.paths:
+            return self.paths[name]
+        if query is None:
+            query = self.scoops[name]
+        return scoop.compile_query(query)
+
+    def forget(self, alias=None):
+        # drop the in-memory results of one API (or all of them)...
+        if alias is None:
+            super().clear()
+            self.failures.clear()
+            self.fetched.clear()
+            self.partials.clear()
+            self.snapshots.clear()
+            self.versions.clear()
+            self.stale.clear()
+        else:
+            super().pop(alias, None)
+            self.failures.pop(alias, None)
+            self.fetched.pop(alias, None)
+            self.partials.pop(alias, None)
+            self.snapshots.pop(alias, None)
+            self.versions.pop(alias, None)
+            self.stale.discard(alias)
+            for jobs in (self.failures, self.fetched):
+                for job in list(jobs):
+                    if isinstance(job, tuple) and job[0] == alias:
+                        del jobs[job]
+            # ...and the results derived from it
+            for other, plan in self.plans.items():
+                if any(upstream == alias for _, upstream, _ in plan.depends):
+                    self.forget(other)
+
+    def invalidate(self, alias=None):
+        # forget the results of one API (or all of them), here
+        # and in the cross-invocation cache...
+        self.forget(alias)
+        self.cache.invalidate(self.name, alias)
+        try:
+            breaker.reset(self.name, alias)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _call(function, args, kwargs):
+        result = function(*args, **kwargs)
+        if inspect.isawaitable(result):
+            # an "async def" fetcher, run it to completion on its own loop
+            # (prefetch() gives each API its own thread)...
+            import asyncio
+            result = asyncio.run(result)
+        return result
+
+    def _throttle(self, item, stale=None):
+        # wait for a token of a rate limited API, unless it may (and can)
+        # be answered with the stale cache entry, which is then returned...
+        policy = self.policies.get(item, {})
+        if not policy.get('rate'):
+            return None
+        key = policy.get('rate_key') or '{}.{}'.format(self.name, item)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(key, *policy['rate'])
+        on_limit = self.on_limit or policy.get('on_limit') or 'block'
+        if on_limit == 'stale' and stale is not None:
+            if bucket.take(block=False) is None:
+                timings.annotate(rate_limited='stale')
+                return stale
+            return None
+        wait = bucket.take()
+        if wait:
+            timings.annotate(rate_limited=round(wait * 1000, 3))
+            time.sleep(wait)
+        return None
+
+    def throttle(self, item):
+        # wait for a token of a rate limited API for one more request, for
+        # a plugin function which makes more than the one every call of
+        # it is charged for...
+        self._throttle(item)
+
+    def _breaker(self, item):
+        # the circuit breaker of an API declared with fail_ttl, one per
+        # set of API arguments (pushdowns share the one of their API)...
+        policy = self.policies.get(item, {})
+        if not policy.get('fail_ttl') or self.cache_mode == 'off':
+            return None
+        # ...and for file backed APIs per version of the files, a file
+        # which was fixed (or appeared) is tried right away
+        key = self._key(item, *self._arguments(item))
+        path = os.path.join(breaker.breaker_dir(self.name, item),
+                            self.cache.digest(key) + '.json')
+        return breaker.CircuitBreaker(path, policy.get('fail_threshold', 1),
+                                      policy['fail_ttl'])
+
+    def _guarded(self, item, function, args, kwargs):
+        # call the fetcher, failing fast while its circuit breaker is open...
+        try:
+            guard = self._breaker(item)
+        except OSError:
+            guard = None
+        if guard is None:
+            return self._call(function, args, kwargs)
+        if self.cache_mode == 'use':
+            # (--refresh probes right away)
+            state = guard.check()
+            if state is not None:
+                timings.annotate(breaker='open')
+                raise RuntimeError('{} (failed {} times, next try in {:.0f}s)'
+                                   .format(state['error'], state['failures'],
+                                           state['until'] - time.time()))
+        try:
+            result = self._call(function, args, kwargs)
+        except KeyError as e:
+            if function is self.pushdowns.get(item):
+                # no such item (see pushdown), the API itself is fine...
+                guard.succeeded()
+            else:
+                guard.failed(str(e) or repr(e))
+            raise
+        except Exception as e:
+            guard.failed(str(e) or repr(e))
+            raise
+        guard.succeeded()
+        return result
+
+    def _fetch(self, item, function, args, kwargs, upstream=None):
+        # upstream holds the results of the APIs this one depends on...
+        if upstream:
+            function = self.plans[item].with_upstream(upstream)
+        policy = self.policies.get(item, {})
+        ttl = policy.get('ttl')
+        if not ttl or self.cache_mode == 'off':
+            timings.annotate(cache='off')
+            self._throttle(item)
+            return self._guarded(item, function, args, kwargs)
+        key = self._key(item, args, kwargs)
+        if upstream:
+            # a derived result is only reused for the same upstream results...
+            key.append({alias: self.cache.digest(value)
+                        for alias, value in upstream.items()})
+        started = time.time()
+        if self.cache_mode == 'use':
+            entry = self.cache.lookup(key)
+            if entry is not None and entry['expires'] > started:
+                timings.annotate(cache='hit')
+                return entry['value']
+            if entry is not None and \
+                    started - entry['expires'] < policy.get('max_stale', 0):
+                # stale-while-revalidate, answer now and let a detached
+                # process (or a thread) fetch it for the next caller...
+                from cliapi import refresh
+                if function is self.pushdowns.get(item):
+                    job = (item, tuple(args[0]))
+                else:
+                    job = item
+
+                def fetch():
+                    self._refresh(item, function, args, kwargs, key, ttl)
+                timings.annotate(cache='stale', refreshing=refresh.spawn(
+                    self, job, key, fetch))
+                self.stale.add(item)
+                return entry['value']
+        # single-flight: one process fetches, the ones arriving meanwhile
+        # wait for it and take its result...
+        with self.cache.flight(key):
+            entry = self.cache.lookup(key)
+            if entry is not None and entry['stored'] >= started:
+                timings.annotate(cache='coalesced',
+                                 waited_ms=round((time.time() - started) * 1000, 3))
+                return entry['value']
+            timings.annotate(cache='miss' if self.cache_mode == 'use'
+                             else self.cache_mode)
+            stale = self._throttle(item, entry if self.cache_mode == 'use'
+                                   else None)
+            if stale is not None:
+                # rate limited, an expired result will do...
+                timings.annotate(cache='stale')
+                return stale['value']
+            result = self._guarded(item, function, args, kwargs)
+            entry = self._save(key, result, ttl)
+        if entry is not None:
+            self.cache.put_snapshot(entry)
+        return result
+
+    def _save(self, key, result, ttl):
+        # put a result in the cache, unless this process already put the
+        # same one there and it has not expired yet (--watch fetches again
+        # every round, mostly the same)...
+        digest = self.cache.digest(key)
+        saved = self.saved.get(digest)
+        if saved is not None and saved[1] > time.time():
+            from cliapi.watch import fingerprint
+            if fingerprint(saved[0]) == fingerprint(result):
+                timings.annotate(unchanged=True)
+                return None
+        entry = self.cache.put(key, result, ttl)
+        self.saved[digest] = (result, entry['expires'])
+        return entry
+
+    def _versions(self, item):
+        # the versions of the files a file backed API reads, or None...
+        paths = self.policies.get(item, {}).get('files')
+        if not paths:
+            return None
+        return [backing_files.version(path) for path in paths]
+
+    def _key(self, item, args, kwargs):
+        # what a result of an API is cached under...
+        key = [self.name, item, args, kwargs]
+        versions = self._versions(item)
+        if versions is not None:
+            # file backed, the same files give the same result...
+            key.append({'files': versions})
+            self.versions[item] = versions
+        return key
+
+    def _refresh(self, item, function, args, kwargs, key, ttl):
+        # fetch and save a result again, see cliapi.refresh...
+        with self.cache.flight(key):
+            self._throttle(item)
+            result = self._guarded(item, function, args, kwargs)
+            entry = self.cache.put(key, result, ttl)
+        self.cache.put_snapshot(entry)
+
+    def _arguments(self, item):
+        # replace API args and kwargs with CLI provided options...
+        return self.plans[item].bind(self.template)
+
+    def _upstream(self, item, plan):
+        # the results of the APIs this one depends on, {alias: result}...
+        values = {}
+        for _, alias, _ in plan.depends:
+            if alias in values:
+                continue
+            if alias not in self.plans:
+                raise FetchError(
+                    '{} -- depends on unknown API {}'.format(item, alias))
+            if alias in self.failures:
+                # it failed in the background, leave the error to be
+                # reported by its own lookup too...
+                raise FetchError('{} -- {} failed: {}'.format(
+                    item, alias, self.failures[alias]))
+            values[alias] = self[alias]
+        return values
+
     def __getitem__(self, item):
 
         try:
             result = super().__getitem__(item)
         except KeyError:
+            if item in self.failures:
+                # it already failed in the background...
+                raise self.failures.pop(item)
             # this dictionary item does not currently exist
             # so fetch it using the API which resolves to
             # the top level dictionary with that API key name...
-            fetcher = self.fetchers[item]
-            fetcher_function = fetcher[0].split('.')
-
-            # setup for calling the appropriate plugin API...
-            provider = importlib.import_module('.'.join(fetcher_function[0:3]))
-
-            arg_list = list()
-            kwarg_dict = dict()
+            plan = self.plans[item]
+            arg_list, kwarg_dict = plan.bind(self.template)
+            upstream = self._upstream(item, plan)
             try:
-                # replace API args and kwargs with CLI provided options...
-                for arg in fetcher[1][0]:
-                    # build the *args tuple...
-                    arg_list.append(Template(arg).substitute(self.template))
-                for key, value in fetcher[1][1].items():
-                    # build the **kwargs dictionary...
-                    kwarg_dict[key] = Template(value).substitute(self.template)
-                function = getattr(provider, fetcher_function[3])
-                    # fault-in the API values...
-                super().__setitem__(item, function(*arg_list, **kwarg_dict))
+                # fault-in the API values, or reuse a cached result...
+                with span('fetch ' + item):
+                    result = self._fetch(item, plan.function,
+                                         arg_list, kwarg_dict, upstream)
             except Exception as e:
-                raise AssertionError('required option {}, missing'.format(e))
+                # the API itself failed...
+                raise FetchError('{} -- {}'.format(item, e))
+            super().__setitem__(item, result)
+            self.fetched[item] = time.monotonic()
             # rerun the dictionary lookup and return results...
             result = self.get(item)
         return result
 
 
-def cliapi_compile(prov, api_alias=None, scoops={}, options={}, help={}):
+def cliapi_compile(prov, api_alias=None, scoops={}, options={}, help={},
+                   ttl=None, pushdown=None, depends=None, rate=None,
+                   rate_key=None, on_limit='block', fail_ttl=None,
+                   fail_threshold=1, files=None, max_stale=None):
     # Compile each API supported by the plugin provider as a python
     # function and assemble into the various dictionaries of
     # the "Provider" class.
     # These dictionaries are later used by the "cliapi engine"
     # in "cliapi.main()" to create a Unix, getopt()-style CLI...
+    #
+    # ttl: seconds the API results may be reused by later invocations
+    # pushdown: a function fetching only the subtree a scoop needs, called
+    #     as pushdown(path, *args, **kwargs) with the keys/indexes below the
+    #     API and the same arguments as the API, raising KeyError for a path
+    #     which does not exist
+    # depends: the APIs whose results this one is computed from, a list of
+    #     aliases (passed as the parameter of the same name, "-" read as "_")
+    #     or a dictionary of {parameter: alias}.  They are fetched first,
+    #     and only once, whichever APIs need them
+    # rate: (calls per second, burst) allowed to this API by all cliapi
+    #     processes on the host together, see cliapi.ratelimit
+    # rate_key: name of the limit, APIs of the same endpoint share one
+    # on_limit: when the limit is reached 'block' (wait for a turn) or
+    #     'stale' (answer with an expired cached result, if there is one)
+    # fail_ttl: seconds an API which failed fail_threshold times in a row
+    #     fails fast with its last error (in every cliapi process) before
+    #     it is tried again, see cliapi.breaker
+    # max_stale: seconds after the ttl during which an expired result is
+    #     still answered right away, while a detached process (one per
+    #     result) fetches a new one, see cliapi.refresh.  Past that,
+    #     callers wait for a fetch
+    # files: the file (or list of files) the API reads, its results are
+    #     cached under their (inode, mtime, size), for a day unless a ttl is
+    #     given, and reused until one of them changes, see cliapi.files
 
     def assemble_it(func):
         # REMEMBER: All this work happens at "import time"...
@@ -67,8 +787,17 @@ def cliapi_compile(prov, api_alias=None, scoops={}, options={}, help={}):
             alias = func.__name__
         else:
             alias = api_alias
+        if prov.name is None:
+            # providers are named after their plugin module...
+            prov.name = func.__module__.split('.')[-1]
         # assemble more scoops...
         prov.scoops.update(scoops)
+        for name, lookup in scoops.items():
+            try:
+                prov.paths[name] = scoop.compile_path(lookup)
+            except SyntaxError:
+                # reported when (and if) this scoop is used...
+                prov.paths.pop(name, None)
         # assemble more plugin options...
         prov.options.update(options)
         # assemble more help...
@@ -78,16 +807,29 @@ def cliapi_compile(prov, api_alias=None, scoops={}, options={}, help={}):
         # use introspection to extract calling requirements
         # for this particular "API fetcher" and save in fetchers
         # dictionary for later when it is actually called...
-        argspec = inspect.getargspec(func)
+        argspec = inspect.getfullargspec(func)
         if argspec.defaults is None:
             default_count = 0
         else:
             default_count = len(argspec.defaults)
         last_arg = len(argspec.args) - default_count
+        if isinstance(depends, dict):
+            upstream = dict(depends)
+        else:
+            upstream = {a.replace('-', '_'): a for a in depends or ()}
+        for param in upstream:
+            if param not in argspec.args:
+                raise ValueError('{} -- no parameter {} for API {}'.format(
+                    alias, param, upstream[param]))
         func_args = []
         func_kwargs = {}
+        func_depends = []
         for i, arg in enumerate(argspec.args):
-            if i < last_arg:
+            if arg in upstream:
+                # the result of another API, not a CLI option...
+                func_depends.append((arg, upstream[arg],
+                                     i if i < last_arg else None))
+            elif i < last_arg:
                 # substitute CLI options...
                 arg = prov.options.get(arg, arg)
                 func_args.append(arg)
@@ -99,28 +841,43 @@ def cliapi_compile(prov, api_alias=None, scoops={}, options={}, help={}):
                     prov.template[op_default[1:]] = default
                 func_kwargs[arg] = op_default
 
+        if isinstance(files, str):
+            paths = [files]
+        else:
+            paths = list(files or ())
+        prov.policies[alias] = {'ttl': FILE_TTL if paths and ttl is None
+                                else ttl}
+        if paths:
+            prov.policies[alias]['files'] = paths
+        if rate is not None:
+            if on_limit not in ('block', 'stale'):
+                raise ValueError('{} -- on_limit must be block or stale'
+                                 .format(alias))
+            prov.policies[alias].update(rate=list(rate), rate_key=rate_key,
+                                        on_limit=on_limit)
+        if max_stale:
+            prov.policies[alias]['max_stale'] = max_stale
+        if fail_ttl:
+            prov.policies[alias].update(fail_ttl=fail_ttl,
+                                        fail_threshold=fail_threshold)
+        if upstream:
+            prov.policies[alias]['depends'] = sorted(set(upstream.values()))
+        if pushdown is not None:
+            prov.pushdowns[alias] = pushdown
+
         # Register this function as an "API fetcher"...
         prov.fetchers.update({alias:
                                   (func.__module__ + '.' +
                                    func.__name__,
                                    (func_args, func_kwargs))
                               })
-
-        def do_it(*args, **kwargs):
-            # REMEMBER: All this work happens at call time...
-            # TODO: this is a hack
-            # at a "Universal Python Function Wrapper".
-            # There is probably a better way to do this but it
-            # eludes me at the moment...
-            if len(args) == 0:
-                a = ()
-            else:
-                a = args
-            if len(kwargs) == 0:
-                b = {}
-            else:
-                b = kwargs
-            return func(*a, **b)
-        return do_it
+        # ...and resolve once how it is called on a fault-in, the
+        # plugin function itself is left as it is...
+        prov.plans[alias] = CallPlan(func, func_args, func_kwargs,
+                                     func_depends)
+        cycle = _cycle(prov.plans, alias)
+        if cycle is not None:
+            raise ValueError('dependency cycle -- ' + ' -> '.join(cycle))
+        return func
 
     return assemble_it
@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import socket
+
+# A long running "cliapi --serve" keeps the imported providers, and the API
+# results they fetched, warm between requests.  Requests and responses are
+# single JSON lines over a Unix domain socket:
+#
+#   -> {"argv": ["--internal-ip"]}
+#   <- {"status": 0, "stdout": "\"172.16.3.8\"\n", "stderr": ""}
+#
+# The client side is deliberately cheap to import, it runs before any of
+# the framework is loaded and returns None whenever no daemon answers so
+# the caller can run the request in-process instead.
+
+SOCKET_ENV = 'CLIAPI_SOCKET'
+CONNECT_TIMEOUT = 0.5
+REQUEST_TIMEOUT = 60
+
+
+def socket_path():
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    from cliapi.cache import cache_dir
+    return os.path.join(cache_dir(), 'cliapi.sock')
+
+
+def _recv_line(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b'\n'):
+            break
+    return b''.join(chunks)
+
+
+def request(argv, path=None):
+    # run argv in the daemon, returning its response or None...
+    if path is None:
+        try:
+            path = socket_path()
+        except OSError:
+            return None
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(path)
+        sock.settimeout(REQUEST_TIMEOUT)
+        sock.sendall(json.dumps({'argv': list(argv)}).encode('utf-8') + b'\n')
+        return json.loads(_recv_line(sock).decode('utf-8'))
+    except (OSError, ValueError):
+        # no daemon (or a broken one), run in-process...
+        return None
+    finally:
+        sock.close()
+
+
+def _handle(run, line):
+    import io
+    from contextlib import redirect_stdout, redirect_stderr
+    try:
+        argv = json.loads(line.decode('utf-8'))['argv']
+    except (ValueError, KeyError, TypeError):
+        return {'status': 2, 'stdout': '', 'stderr': 'bad request\n'}
+    out, err = io.StringIO(), io.StringIO()
+    status = 0
+    with redirect_stdout(out), redirect_stderr(err):
+        try:
+            run(argv)
+        except SystemExit as e:
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                print(e.code, file=err)
+                status = 1
+        except Exception as e:
+            print('cliapi daemon: {!r}'.format(e), file=err)
+            status = 1
+    return {'status': status, 'stdout': out.getvalue(),
+            'stderr': err.getvalue()}
+
+
+def serve(run, path=None):
+    # answer requests one at a time, forever.
+    # "run" is the in-process CLI, called with the argv of each request...
+    import signal
+    import socketserver
+
+    # stop (and clean up the socket) on SIGTERM...
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    if path is None:
+        path = socket_path()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return
+            response = _handle(run, line)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+    try:
+        # a socket left behind by a daemon which died...
+        os.unlink(path)
+    except OSError:
+        pass
+    old_umask = os.umask(0o077)
+    try:
+        server = socketserver.UnixStreamServer(path, Handler)
+    finally:
+        os.umask(old_umask)
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,153 @@
+import os
+import sys
+import importlib
+import pkgutil
+
+import cliapi.providers as providers
+import cliapi.cliapi_lib as cliapi_lib
+import cliapi.what_cloud as what_cloud
+from cliapi.cache import cache_dir, boot_id, read_json, atomic_write_json
+from cliapi.timings import span
+
+# Provider discovery...
+# Importing a plugin is expensive (it may probe the cloud it runs in), so
+# the result of importing every plugin once is saved in a "manifest" which
+# is keyed on the plugin files.  Later runs read the manifest and import
+# only the provider which was actually selected.
+
+MANIFEST_VERSION = 1
+prefix = providers.__name__ + '.'
+
+
+def _stat(path):
+    st = os.stat(path)
+    return [path, st.st_mtime_ns, st.st_size]
+
+
+def plugin_files():
+    # name -> [path, mtime, size] for every candidate provider module...
+    files = {}
+    for finder, name, _ in pkgutil.iter_modules(providers.__path__):
+        spec = finder.find_spec(name)
+        if spec is None or spec.origin is None:
+            continue
+        files[name] = _stat(spec.origin)
+    return files
+
+
+def _manifest_key():
+    # anything that can change the outcome of importing the plugins...
+    return {'version': MANIFEST_VERSION,
+            'python': sys.version,
+            'boot_id': boot_id(),
+            'framework': [_stat(cliapi_lib.__file__),
+                          _stat(what_cloud.__file__)],
+            'files': plugin_files(),
+            }
+
+
+def describe(provider):
+    # the import-time assembled dictionaries of a provider plugin...
+    return {'scoops': provider.scoops,
+            'options': provider.options,
+            'help': provider.help,
+            'template': provider.template,
+            'fetchers': provider.fetchers,
+            'policies': provider.policies,
+            }
+
+
+def build_manifest(key=None):
+    # import every plugin once and record what it provides...
+    if key is None:
+        key = _manifest_key()
+    entries = {}
+    for name in key['files']:
+        try:
+            module = importlib.import_module(prefix + name)
+            entries[name] = describe(module.provider)
+        except Exception as e:
+            # not a valid provider for this host...
+            entries[name] = {'error': repr(e)}
+    manifest = dict(key)
+    manifest['providers'] = entries
+    return manifest
+
+
+def manifest_path():
+    return os.path.join(cache_dir(), 'manifest.json')
+
+
+def load_manifest():
+    with span('discover') as s:
+        manifest, origin = _load_manifest()
+        s.annotate(manifest=origin)
+        return manifest
+
+
+def _load_manifest():
+    # return the cached manifest if the plugins have not changed,
+    # otherwise (re)build and save it...
+    key = _manifest_key()
+    try:
+        path = manifest_path()
+    except OSError:
+        path = None
+    if path is not None:
+        manifest = read_json(path)
+        if manifest is not None and \
+                all(manifest.get(k) == v for k, v in key.items()):
+            return manifest, 'cached'
+    manifest = build_manifest(key)
+    if path is not None:
+        try:
+            atomic_write_json(path, manifest)
+        except OSError:
+            # unable to save the manifest, just rebuild it next time...
+            pass
+    return manifest, 'built'
+
+
+# the manifest of a long running process, see current_manifest()...
+_current = None
+
+
+def _stamp(manifest):
+    # a cheap check of the plugins behind a loaded manifest: the providers
+    # directory (plugins added or removed) and each plugin file...
+    stamp = []
+    for path in list(providers.__path__) + \
+            [entry[0] for entry in manifest['files'].values()]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            stamp.append(None)
+            continue
+        stamp.append([st.st_mtime_ns, st.st_size])
+    return stamp
+
+
+def current_manifest(refresh=False):
+    # the manifest, loaded once by this process and kept in memory; it is
+    # only loaded again (see load_manifest()) when a plugin file changed
+    # or refresh is asked for, e.g. after a provider was not found...
+    global _current
+    if _current is not None and not refresh:
+        manifest, stamp = _current
+        if _stamp(manifest) == stamp:
+            return manifest
+    manifest = load_manifest()
+    _current = (manifest, _stamp(manifest))
+    return manifest
+
+
+def valid_providers(manifest):
+    # names of the providers which imported cleanly, in discovery order...
+    return [name for name, entry in manifest['providers'].items()
+            if 'error' not in entry]
+
+
+def load_provider(name):
+    # import only the selected provider plugin...
+    with span('import ' + name):
+        return importlib.import_module(prefix + name).provider
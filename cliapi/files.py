@@ -0,0 +1,40 @@
+import os
+
+# Helpers of file backed APIs, see cliapi_compile(..., files=[...]).
+# Their results are cached under the version of the files they read, i.e.
+# (inode, mtime, size), so a file is only parsed again when it was replaced
+# or written, and then only as far as the plugin needs:
+#
+#   from cliapi.cliapi_lib import xml_first
+#
+#   service = xml_first('/var/lib/waagent/SharedConfig.xml', 'Deployment/Service')
+
+
+def version(path):
+    # what identifies the contents of a file without reading it,
+    # [inode, mtime_ns, size] or None when it does not exist...
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_ino, st.st_mtime_ns, st.st_size]
+
+
+def xml_first(path, element):
+    # the attributes of the first element at the element path (relative to
+    # the root element, like root.find('Deployment/Service')) or None.
+    # The document is parsed as a stream and only up to that element, and
+    # elements already parsed are dropped as they are closed...
+    from xml.etree.ElementTree import iterparse
+    wanted = element.split('/')
+    tags = []
+    with open(path, 'rb') as f:
+        for event, elem in iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                tags.append(elem.tag)
+                if tags[1:] == wanted:
+                    return dict(elem.attrib)
+            else:
+                tags.pop()
+                elem.clear()
+    return None
@@ -0,0 +1,52 @@
+from cliapi.scoop import format_path
+
+# A flattened index of an API result for --list-paths and --find=: every
+# leaf of the document as [query, value], e.g.
+#
+#   ["['meta_data']['network']['interface'][0]['macAddress']", "000D3A..."]
+#
+# where query can be given to --query= as is.  It is built in a single walk
+# over the document and saved along with its cached result (see
+# ResultCache.put), so a later search is one scan of a flat list.
+
+_types = ((bool, 'boolean'), (str, 'string'), ((int, float), 'number'),
+          (dict, 'object'), (list, 'array'), (type(None), 'null'))
+
+
+def flatten(alias, value):
+    # the [query, value] of every leaf below the API alias, in document
+    # order.  Empty objects and arrays are leaves too...
+    leaves = []
+    stack = [((alias,), value)]
+    while stack:
+        path, value = stack.pop()
+        if isinstance(value, dict) and value:
+            items = value.items()
+        elif isinstance(value, list) and value:
+            items = enumerate(value)
+        else:
+            leaves.append([format_path(path), value])
+            continue
+        stack.extend(reversed([(path + (key,), item) for key, item in items]))
+    return leaves
+
+
+def type_of(value):
+    # the JSON type name of a leaf...
+    for types, name in _types:
+        if isinstance(value, types):
+            return name
+    return type(value).__name__
+
+
+def find(leaves, term):
+    # the leaves whose query (any key along it) or value contains term,
+    # ignoring case...
+    term = term.lower()
+    found = []
+    for query, value in leaves:
+        if term in query.lower() or \
+                not isinstance(value, (dict, list)) and \
+                term in str(value).lower():
+            found.append([query, value])
+    return found
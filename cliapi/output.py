@@ -0,0 +1,108 @@
+import json
+
+# Output modes of the cliapi CLI:
+#   pretty  - indented JSON (the default)
+#   compact - JSON without any whitespace
+#   ndjson  - one compact JSON document per result (per API with --all)
+#   raw     - like ndjson but strings are written as is, for shell use
+#
+# Documents are written piece by piece with JSONEncoder.iterencode() and
+# ndjson/raw "--all" output starts before the last API has been fetched.
+# orjson is used for the compact encodings when it is installed.
+
+MODES = ('pretty', 'compact', 'ndjson', 'raw')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_pretty = json.JSONEncoder(indent=2)
+_compact = json.JSONEncoder(separators=(',', ':'))
+
+
+def dumps(value):
+    # a compact single line JSON encoding of value...
+    if orjson is not None:
+        try:
+            return orjson.dumps(value).decode('utf-8')
+        except TypeError:
+            # e.g. a non-string dictionary key, let json deal with it...
+            pass
+    return _compact.encode(value)
+
+
+def _stream(encoder, value, out):
+    for chunk in encoder.iterencode(value):
+        out.write(chunk)
+    out.write('\n')
+
+
+def _line(value, mode, out):
+    if mode == 'raw' and isinstance(value, str):
+        out.write(value)
+    else:
+        out.write(dumps(value))
+    out.write('\n')
+    out.flush()
+
+
+def write(value, mode, out):
+    # a single JSON document...
+    if mode == 'pretty':
+        _stream(_pretty, value, out)
+    else:
+        _line(value, mode, out)
+
+
+def write_results(results, mode, out):
+    # the results of several scoops/queries in option order, a single
+    # result is not wrapped in a list...
+    if mode in ('ndjson', 'raw'):
+        for value in results:
+            _line(value, mode, out)
+        return
+    if len(results) == 1:
+        results = results[0]
+    write(results, mode, out)
+
+
+class _Pending(dict):
+    # a dictionary whose values are only resolved while it is being
+    # encoded, in key order.  What was encoded so far is flushed out
+    # before waiting for the next value...
+    def __init__(self, keys, resolve, out):
+        super().__init__((key, None) for key in keys)
+        self.resolve = resolve
+        self.out = out
+
+    def items(self):
+        for key in self.keys():
+            self.out.flush()
+            yield key, self.resolve(key)
+
+
+def write_mapping(keys, resolve, mode, out):
+    # a {key: resolve(key)} document written as each value resolves.
+    # The first value is resolved before anything is written so the
+    # common "first API fails" error does not leave partial output...
+    keys = list(keys)
+    resolved = {}
+    if keys:
+        resolved[keys[0]] = resolve(keys[0])
+
+    def resolve_once(key):
+        if key in resolved:
+            return resolved.pop(key)
+        return resolve(key)
+
+    if mode in ('ndjson', 'raw'):
+        for key in keys:
+            _line({key: resolve_once(key)}, mode, out)
+        return
+    pending = _Pending(keys, resolve_once, out)
+    if mode == 'pretty':
+        _stream(_pretty, pending, out)
+    else:
+        _stream(_compact, pending, out)
+    out.flush()
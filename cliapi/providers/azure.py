@@ -1,11 +1,10 @@
-from cliapi.cliapi_lib import Provider, cliapi_compile
+from cliapi.cliapi_lib import Provider, cliapi_compile, http_client, HttpError, xml_first
 from cliapi.what_cloud import determine_provider
+from cliapi import scoop
 
-import json
 import os
 import uuid
-import urllib.request, urllib.error, urllib.parse
-import xml.etree.ElementTree as ET
+from urllib.parse import quote
 
 try:
     # ----- raises an error on import if not running in a "proper" cloud...
@@ -25,7 +24,7 @@ scoops = {
                    "['ipv4']['ipAddress'][0]['publicIpAddress']",
     'internal-ip': "['meta_data']['network']['interface'][0]"
                    "['ipv4']['ipAddress'][0]['privateIpAddress']",
-    'cloud-service': "['get_cloud_service']"
+    'cloud-service': "['cloud-service']"
 }
 
 help = {
@@ -33,32 +32,98 @@ help = {
     'location': 'region location',
     'mac': 'the MAC address for this interface',
     'api_version': 'azure metadata api version',
-    'cloud-service': 'what'
+    'cloud-service': "the cloud service (from the agent's SharedConfig.xml)"
 }
 
 options = dict(api_version='$api_version')
 
-@cliapi_compile(provider, api_alias='meta_data', scoops=scoops, help=help, options=options)
+# the instance metadata service, overridable to test against a stand-in...
+IMDS = os.environ.get('CLIAPI_AZURE_IMDS', 'http://169.254.169.254')
+HEADERS = {'Metadata': 'true'}
+
+# IMDS serves any subtree of the instance document by path but leaves only
+# as format=text (and subtrees only as format=json), the wrong one is a 400.
+# The paths of the scoops are leaves, other paths are tried as subtrees
+# first and what they turned out to be is remembered...
+_formats = {tuple(scoop.compile_path(lookup)[1:]): 'text'
+            for lookup in scoops.values()
+            if scoop.compile_path(lookup)[0] == 'meta_data'}
+
+
+def _get_format(url, fmt):
+    if fmt == 'json':
+        return http_client().get_json(url + '&format=json', headers=HEADERS)
+    return http_client().get(url + '&format=text',
+                             headers=HEADERS).decode('utf-8')
+
+
+def get_meta_data_path(path, api_version='2017-08-01'):
+    url = '{0}/metadata/instance/{1}?api-version={2}'.format(
+        IMDS, '/'.join(quote(str(key), safe='') for key in path), api_version)
+    fmt = _formats.get(tuple(path), 'json')
+    try:
+        try:
+            return _get_format(url, fmt)
+        except HttpError as e:
+            if e.status != 400:
+                raise
+            # the other format, one more request of the rate limit...
+            provider.throttle('meta_data')
+            fmt = 'text' if fmt == 'json' else 'json'
+            value = _get_format(url, fmt)
+            _formats[tuple(path)] = fmt
+            return value
+    except HttpError as e:
+        if e.status == 404:
+            raise KeyError(path[-1])
+        raise
+
+
+# IMDS allows 5 requests per second per VM, shared by everything on it,
+# and an expired result is still answered while it is fetched again...
+@cliapi_compile(provider, api_alias='meta_data', scoops=scoops, help=help, options=options,
+                ttl=60, pushdown=get_meta_data_path, rate=(5, 5), rate_key='azure-imds',
+                fail_ttl=10, max_stale=600)
 def get_meta_data_azure(api_version='2017-08-01'):
-    HEADERS = {'Metadata': 'true'}
-    IP = '169.254.169.254'
-    url = 'http://{0}/metadata/instance?api-version={1}'.format(IP, api_version)
-    req = urllib.request.Request(url, headers=HEADERS)
-    content = urllib.request.urlopen(req).read()
-    result = json.loads(content.decode('utf-8'))
+    url = '{0}/metadata/instance?api-version={1}'.format(IMDS, api_version)
+    # keep-alive, timeouts and retries come from the shared transport...
+    result = http_client().get_json(url, headers=HEADERS)
     return result
 
 
-@cliapi_compile(provider, api_alias='cloud-service')
+scoops = {
+    'image': "['suse']['image']",
+    'byos': "['suse']['byos']",
+}
+
+help = {
+    'image': 'the marketplace image, publisher:offer:sku:version',
+    'byos': 'is this a bring-your-own-subscription image?',
+}
+
+@cliapi_compile(provider, api_alias='suse', scoops=scoops, help=help, depends=['meta_data'])
+def get_suse_image(meta_data):
+    # derived from meta_data, no metadata service call of its own...
+    compute = meta_data['compute']
+    return {'image': ':'.join(compute[k] for k in ('publisher', 'offer', 'sku', 'version')),
+            'byos': compute['offer'].endswith('BYOS')}
+
+
+# written by the Azure agent, overridable like IMDS...
+SHARED_CONFIG = os.environ.get('CLIAPI_AZURE_SHARED_CONFIG',
+                               '/var/lib/waagent/SharedConfig.xml')
+
+@cliapi_compile(provider, api_alias='cloud-service', files=SHARED_CONFIG, fail_ttl=60)
 def get_cloud_service():
-    # tree = ET.parse('/home/lane/Downloads/SharedConfig.xml')
-    tree = ET.parse('/var/lib/waagent/SharedConfig.xml')
-    root = tree.getroot()
-    cloud_service = root.find('Deployment').find('Service').get('name') + '.cloudapp.net'
-    return cloud_service
+    # parsed again only when the agent rewrites the file, and only
+    # up to the element needed...
+    service = xml_first(SHARED_CONFIG, 'Deployment/Service')
+    if service is None:
+        raise ValueError('no Deployment/Service in ' + SHARED_CONFIG)
+    return service['name'] + '.cloudapp.net'
 
 
-@cliapi_compile(provider, api_alias='tag')
+@cliapi_compile(provider, api_alias='tag', ttl=3600, fail_ttl=60)
 def read_billing_guid(device='/dev/sda'):
     fd = os.open(device, os.O_RDONLY)
     os.lseek(fd, 65536, os.SEEK_SET)
@@ -36,7 +36,7 @@ help = {
     'mac': 'the MAC address for this interface',
 }
 
-@cliapi_compile(provider, api_alias='meta_data', scoops=scoops, help=help)
+@cliapi_compile(provider, api_alias='meta_data', scoops=scoops, help=help, ttl=60)
 def get_meta_data_mock():
     return {"compute": {"location": "westus",
                         "name": "ed-sle12sp3byos", "offer": "SLES-BYOS",
@@ -60,3 +60,17 @@ options = dict(api_version='$api_version')
 @cliapi_compile(provider, api_alias='some_stuff', scoops=scoops, help=help, options=options)
 def get_stuff(api_version='2017-08-01'):
     return api_version
+
+
+scoops = {
+    'vm-size': "['size']['vm_size']",
+}
+
+help = {
+    'vm-size': 'the size of the mock instance',
+}
+
+@cliapi_compile(provider, api_alias='size', scoops=scoops, help=help, depends=['meta_data'])
+def get_size_mock(meta_data):
+    # a derived API to exercise depends=, it makes no call of its own...
+    return {'vm_size': meta_data['compute']['vmSize']}
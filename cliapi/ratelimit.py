@@ -0,0 +1,62 @@
+import os
+import time
+import struct
+
+from cliapi.cache import cache_dir
+
+# Token buckets shared by every cliapi process on this host.
+# A bucket holds up to "burst" tokens and gains "rate" tokens per second,
+# every call to a rate limited API takes one.  Its state, (tokens, time),
+# is kept in a 16 byte file under the cache directory and updated under
+# an flock, so bursts of cliapi processes are spread out evenly instead
+# of running into the endpoint's own limit (and its 429 responses).
+
+_state = struct.Struct('=dd')
+
+
+class TokenBucket(object):
+
+    def __init__(self, key, rate, burst=None, root=None):
+        self.key = key
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.root = root
+
+    def path(self):
+        directory = self.root or cache_dir('ratelimit')
+        return os.path.join(directory,
+                            str(self.key).replace(os.sep, '_') + '.bucket')
+
+    def _update(self, block):
+        # take a token, returns the seconds to wait for it (0 when one was
+        # available) or None when block is false and none is available.
+        # Blocking callers reserve their token (the count goes negative)
+        # so waiters are served in turn...
+        import fcntl
+        fd = os.open(self.path(), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, _state.size, 0)
+            now = time.time()
+            if len(data) == _state.size:
+                tokens, updated = _state.unpack(data)
+                tokens = min(self.burst,
+                             tokens + max(0.0, now - updated) * self.rate)
+            else:
+                # a new bucket starts full...
+                tokens = self.burst
+            if tokens < 1 and not block:
+                return None
+            tokens -= 1
+            os.pwrite(fd, _state.pack(tokens, now), 0)
+        finally:
+            os.close(fd)
+        return 0.0 if tokens >= 0 else -tokens / self.rate
+
+    def take(self, block=True):
+        # see _update(), without a place for the shared state (or without
+        # fcntl) nothing is limited...
+        try:
+            return self._update(block)
+        except (ImportError, OSError):
+            return 0.0
@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import threading
+from subprocess import Popen, DEVNULL
+
+# Stale-while-revalidate, see cliapi_compile(..., max_stale=seconds).
+# A caller answered from an expired cached result starts a detached
+#
+#   python -m cliapi.refresh <fd> <provider> <API> <options> [<subpath>]
+#
+# which fetches the API again (like --refresh) for the callers after it.
+# There is at most one per cache key: the caller takes the "refresh" lock
+# of the key without waiting and hands it over to the refresh process,
+# which holds it until it exits.
+# Long running processes (the daemon, cliapi.query()) neither fork nor
+# leave exited children behind, they refresh on a thread holding the lock.
+
+_threads = False
+
+
+def use_threads():
+    # refresh on threads of this process from now on...
+    global _threads
+    _threads = True
+
+
+def spawn(vpp, job, key, fetch):
+    # start refreshing job (an API alias, or (alias, subpath) of a
+    # pushdown) unless it is already being refreshed, returns whether
+    # a refresh was started.  fetch() refreshes it in this process...
+    fd = vpp.cache.try_lock(key, 'refresh')
+    if fd is None:
+        return False
+    if _threads:
+        def run():
+            try:
+                fetch()
+            except Exception:
+                # the stale result stays, see main()...
+                pass
+            finally:
+                os.close(fd)
+        threading.Thread(target=run, daemon=True).start()
+        return True
+    alias, subpath = job if isinstance(job, tuple) else (job, None)
+    argv = [sys.executable, '-m', 'cliapi.refresh', str(fd), vpp.name,
+            alias, json.dumps(vpp.template)]
+    if subpath is not None:
+        argv.append(json.dumps(list(subpath)))
+    # the cliapi package of this process, and no traces of the refresh
+    # mixed into the ones of this call...
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env.pop('CLIAPI_TIMINGS', None)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (package, env.get('PYTHONPATH')) if p)
+    try:
+        Popen(argv, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+              env=env, pass_fds=(fd,), start_new_session=True)
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+
+def main(argv):
+    # (the refresh lock is held by the inherited descriptor argv[0])
+    name, alias, options = argv[1], argv[2], json.loads(argv[3])
+    from cliapi import discover
+    vpp = discover.load_provider(name)
+    vpp.configure(options)
+    try:
+        # what it depends on is reused from the cache, if fresh...
+        for upstream in vpp.dependencies([alias])[:-1]:
+            vpp[upstream]
+        vpp.cache_mode = 'refresh'
+        if len(argv) > 4:
+            vpp._partial(alias, tuple(json.loads(argv[4])))
+        else:
+            vpp[alias]
+    except Exception:
+        # the stale result stays, a failure is recorded by the API's
+        # circuit breaker (if it has one)...
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
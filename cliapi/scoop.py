@@ -0,0 +1,161 @@
+import re
+import ast
+from collections import namedtuple
+from functools import lru_cache
+
+# Scoops and --query lookups are written in python's dictionary lookup
+# syntax, e.g. "['meta_data']['network']['interface'][0]['macAddress']".
+# Instead of eval()-ing them, they are compiled once into a "path", a
+# tuple of keys and indexes, which is then walked over the Provider.
+#
+# A path may also hold selectors matching several items:
+#   [*]             every item of a list (or value of a dictionary)
+#   [1:3], [::2]    a slice of a list
+#   [?key=='v']     the items of a list whose key equals (!=, differs from)
+#                   a string, number, True, False or None
+# e.g. "['meta_data']['network']['interface'][*]['macAddress']".
+# Such a path is evaluated in a single walk over the document into a
+# flat list of every match; items missing below a selector are skipped.
+
+_string = r''''(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"'''
+_subscript = re.compile(r'\s*\[\s*(' + _string + r'''|-?\d+)\s*\]''')
+_wildcard = re.compile(r'\s*\[\s*\*\s*\]')
+_slice = re.compile(r'\s*\[\s*(-?\d+)?\s*:\s*(-?\d+)?\s*(?::\s*(-?\d+)?\s*)?\]')
+_filter = re.compile(r'\s*\[\s*\?\s*(\w+|' + _string + r')\s*(==|!=)\s*(' +
+                     _string + r'|-?\d+(?:\.\d+)?|True|False|None)\s*\]')
+_trailing = re.compile(r'\s*$')
+
+
+class Wildcard(namedtuple('Wildcard', ())):
+    # [*]...
+    def select(self, value):
+        if isinstance(value, dict):
+            return list(value.values())
+        if isinstance(value, list):
+            return value
+        return ()
+
+
+class Slice(namedtuple('Slice', ('start', 'stop', 'step'))):
+    # [start:stop:step]...
+    def select(self, value):
+        if isinstance(value, list):
+            return value[self.start:self.stop:self.step]
+        return ()
+
+
+class Filter(namedtuple('Filter', ('key', 'op', 'value'))):
+    # [?key=='value'] and [?key!='value']...
+    def select(self, value):
+        if isinstance(value, dict):
+            value = list(value.values())
+        elif not isinstance(value, list):
+            return ()
+        wanted = self.op == '=='
+        return [item for item in value
+                if isinstance(item, dict) and self.key in item and
+                (item[self.key] == self.value) == wanted]
+
+
+# the types of path elements which are selectors...
+SELECTORS = (Wildcard, Slice, Filter)
+
+
+def _int(text):
+    return None if text is None else int(text)
+
+
+def compile_path(lookup):
+    # "['a'][0]['b']" -> ('a', 0, 'b'), raises SyntaxError when the
+    # lookup is anything else than a chain of string/integer subscripts
+    # and the selectors above...
+    path = []
+    pos = 0
+    end = _trailing.search(lookup).start()
+    while pos < end:
+        match = _subscript.match(lookup, pos)
+        if match is not None:
+            path.append(ast.literal_eval(match.group(1)))
+        elif _wildcard.match(lookup, pos):
+            match = _wildcard.match(lookup, pos)
+            path.append(Wildcard())
+        elif _slice.match(lookup, pos):
+            match = _slice.match(lookup, pos)
+            step = _int(match.group(3))
+            if step == 0:
+                raise SyntaxError('slice step cannot be zero',
+                                  ('<query>', 1, pos + 1, lookup))
+            path.append(Slice(_int(match.group(1)), _int(match.group(2)),
+                              step))
+        elif _filter.match(lookup, pos):
+            match = _filter.match(lookup, pos)
+            key = match.group(1)
+            if key[0] in '\'"':
+                key = ast.literal_eval(key)
+            path.append(Filter(key, match.group(2),
+                               ast.literal_eval(match.group(3))))
+        else:
+            raise SyntaxError('invalid query syntax',
+                              ('<query>', 1, pos + 1, lookup))
+        pos = match.end()
+    return tuple(path)
+
+
+def format_path(path):
+    # ('a', 0, 'b') -> "['a'][0]['b']", the query of a path of keys
+    # and indexes...
+    return ''.join('[{!r}]'.format(key) for key in path)
+
+
+# ad-hoc queries go through a bounded cache of compiled paths...
+compile_query = lru_cache(maxsize=256)(compile_path)
+
+
+def literal(path):
+    # the leading keys and indexes of a path, up to its first selector...
+    for i, key in enumerate(path):
+        if isinstance(key, SELECTORS):
+            return path[:i]
+    return path
+
+
+def _project(value, path, i, results):
+    # append every match of path[i:] below value to results...
+    while i < len(path):
+        key = path[i]
+        if isinstance(key, SELECTORS):
+            for item in key.select(value):
+                _project(item, path, i + 1, results)
+            return
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            # nothing there, no match...
+            return
+        i += 1
+    results.append(value)
+
+
+def lookup(root, path):
+    # walk a compiled path, raising KeyError/IndexError like the
+    # equivalent python subscripts would up to the first selector,
+    # which makes the result a list of all matches...
+    value = root
+    for i, key in enumerate(path):
+        if isinstance(key, SELECTORS):
+            results = []
+            _project(value, path, i, results)
+            return results
+        value = value[key]
+    return value
+
+
+def evaluate(root, query):
+    return lookup(root, compile_query(query))
+
+
+def api_of(path):
+    # the top-level API a compiled path depends on, if any...
+    if path and isinstance(path[0], str):
+        return path[0]
+    return None
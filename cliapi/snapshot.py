@@ -0,0 +1,184 @@
+import mmap
+import json
+import struct
+
+from cliapi import scoop
+
+# An indexed binary form of an API result, read through mmap.
+# Every node is stored once with the absolute offsets of its children, so
+# a lookup path is answered by decoding only the nodes along it, and every
+# process reading the same snapshot shares one page cached copy.
+#
+#   header  magic, version, root offset, stored and expires times
+#   node    one tag byte and its payload:
+#     N T F             None, True, False
+#     I  int64          D  float64
+#     S  u32 length, utf-8 bytes
+#     J  u32 length, JSON text (e.g. integers beyond 64 bits)
+#     M  u32 count, count * (u32 key offset, u32 value offset)
+#     L  u32 count, count * u32 item offset
+#
+# Children are written before their parent, equal strings (e.g. the keys
+# of a list of dictionaries) only once.
+
+MAGIC = b'CLSN'
+VERSION = 1
+
+_header = struct.Struct('<4sHHIdd')
+_u32 = struct.Struct('<I')
+_pair = struct.Struct('<II')
+_int = struct.Struct('<q')
+_float = struct.Struct('<d')
+
+
+class _Writer(object):
+
+    def __init__(self):
+        self.out = bytearray(_header.size)
+        self.strings = {}
+
+    def _sized(self, tag, data):
+        offset = len(self.out)
+        self.out += tag + _u32.pack(len(data)) + data
+        return offset
+
+    def node(self, value):
+        # append value, returns its offset...
+        if isinstance(value, str):
+            offset = self.strings.get(value)
+            if offset is None:
+                offset = self.strings[value] = self._sized(
+                    b'S', value.encode('utf-8'))
+            return offset
+        offset = len(self.out)
+        if value is None:
+            self.out += b'N'
+        elif value is True:
+            self.out += b'T'
+        elif value is False:
+            self.out += b'F'
+        elif isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+            self.out += b'I' + _int.pack(value)
+        elif isinstance(value, float):
+            self.out += b'D' + _float.pack(value)
+        elif isinstance(value, dict):
+            pairs = [(self.node(str(key)), self.node(item))
+                     for key, item in value.items()]
+            offset = len(self.out)
+            self.out += b'M' + _u32.pack(len(pairs))
+            for pair in pairs:
+                self.out += _pair.pack(*pair)
+        elif isinstance(value, (list, tuple)):
+            items = [self.node(item) for item in value]
+            offset = len(self.out)
+            self.out += b'L' + _u32.pack(len(items))
+            for item in items:
+                self.out += _u32.pack(item)
+        else:
+            offset = self._sized(b'J', json.dumps(value).encode('utf-8'))
+        return offset
+
+
+def encode(value, stored=0.0, expires=0.0):
+    # the snapshot of a JSON-like value...
+    writer = _Writer()
+    root = writer.node(value)
+    _header.pack_into(writer.out, 0, MAGIC, VERSION, 0, root, stored, expires)
+    return bytes(writer.out)
+
+
+class Snapshot(object):
+
+    def __init__(self, path):
+        # raises OSError, or ValueError for something else than a snapshot...
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, _, self.root, self.stored, self.expires = \
+                _header.unpack_from(self.map, 0)
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('not a cliapi snapshot -- ' + path)
+
+    def close(self):
+        self.map.close()
+
+    def _string(self, offset):
+        length, = _u32.unpack_from(self.map, offset + 1)
+        return self.map[offset + 5:offset + 5 + length].decode('utf-8')
+
+    def decode(self, offset=None):
+        # the value of a node and everything below it...
+        if offset is None:
+            offset = self.root
+        m = self.map
+        tag = m[offset:offset + 1]
+        if tag == b'S':
+            return self._string(offset)
+        if tag == b'M':
+            count, = _u32.unpack_from(m, offset + 1)
+            result = {}
+            for i in range(count):
+                key, value = _pair.unpack_from(m, offset + 5 + 8 * i)
+                result[self._string(key)] = self.decode(value)
+            return result
+        if tag == b'L':
+            count, = _u32.unpack_from(m, offset + 1)
+            return [self.decode(_u32.unpack_from(m, offset + 5 + 4 * i)[0])
+                    for i in range(count)]
+        if tag == b'I':
+            return _int.unpack_from(m, offset + 1)[0]
+        if tag == b'D':
+            return _float.unpack_from(m, offset + 1)[0]
+        if tag == b'N':
+            return None
+        if tag == b'T':
+            return True
+        if tag == b'F':
+            return False
+        if tag == b'J':
+            return json.loads(self._string(offset))
+        raise ValueError('bad snapshot node at {}'.format(offset))
+
+    def _child(self, offset, key):
+        # the offset of node[key], None when node is no container...
+        m = self.map
+        tag = m[offset:offset + 1]
+        if tag == b'M':
+            if not isinstance(key, str):
+                raise KeyError(key)
+            wanted = key.encode('utf-8')
+            count, = _u32.unpack_from(m, offset + 1)
+            for i in range(count):
+                name, value = _pair.unpack_from(m, offset + 5 + 8 * i)
+                length, = _u32.unpack_from(m, name + 1)
+                if length == len(wanted) and \
+                        m[name + 5:name + 5 + length] == wanted:
+                    return value
+            raise KeyError(key)
+        if tag == b'L':
+            if not isinstance(key, int) or isinstance(key, bool):
+                raise TypeError('list indices must be integers')
+            count, = _u32.unpack_from(m, offset + 1)
+            index = key + count if key < 0 else key
+            if not 0 <= index < count:
+                raise IndexError('list index out of range')
+            return _u32.unpack_from(m, offset + 5 + 4 * index)[0]
+        return None
+
+    def lookup(self, path):
+        # like scoop.lookup() over the decoded value, decoding only the
+        # nodes along the keys and indexes of path...
+        offset = self.root
+        for i, key in enumerate(path):
+            if isinstance(key, scoop.SELECTORS):
+                break
+            child = self._child(offset, key)
+            if child is None:
+                break
+            offset = child
+        else:
+            return self.decode(offset)
+        return scoop.lookup(self.decode(offset), path[i:])
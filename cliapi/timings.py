@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import threading
+import contextvars
+
+# Opt-in tracing of where a cliapi call spends its time.
+# "--timings" (or CLIAPI_TIMINGS=1, or CLIAPI_TIMINGS=<file>) records a tree
+# of spans, e.g. provider import, cloud detection, option parsing, every
+# fetcher with its cache hit/miss, HTTP requests with retries and bytes,
+# scoop evaluation and output encoding, and writes it as JSON to stderr
+# (or the file) when the call is done.
+#
+# Plugins add their own spans with:
+#
+#   from cliapi.cliapi_lib import span
+#
+#   with span('parse SharedConfig.xml', path=path) as s:
+#       ...
+#
+# When tracing is off span() costs a single check.
+
+ENV = 'CLIAPI_TIMINGS'
+
+_root = None
+_target = None
+_current = contextvars.ContextVar('cliapi_span', default=None)
+_lock = threading.Lock()
+
+
+class _NoSpan(object):
+    # stands in for a span when tracing is off...
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def annotate(self, **attrs):
+        pass
+
+
+_no_span = _NoSpan()
+
+
+class Span(object):
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+        self.end = None
+        self.children = []
+        self.thread = threading.current_thread().name
+        self._token = None
+
+    def __enter__(self):
+        parent = _current.get() or _root
+        with _lock:
+            parent.children.append(self)
+        self._token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc is not None and not isinstance(exc, SystemExit):
+            self.attrs['error'] = repr(exc)
+        _current.reset(self._token)
+        return False
+
+    def annotate(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, origin):
+        end = self.end if self.end is not None else time.perf_counter()
+        result = {'name': self.name,
+                  'start_ms': round((self.start - origin) * 1000, 3),
+                  'ms': round((end - self.start) * 1000, 3)}
+        if self.thread != 'MainThread':
+            result['thread'] = self.thread
+        if self.attrs:
+            result['attrs'] = self.attrs
+        if self.children:
+            result['children'] = [child.to_dict(origin)
+                                  for child in self.children]
+        return result
+
+
+def enabled():
+    return _root is not None
+
+
+def span(name, **attrs):
+    # a context manager timing the enclosed block as a child of the
+    # current span...
+    if _root is None:
+        return _no_span
+    return Span(name, attrs)
+
+
+def annotate(**attrs):
+    # add attributes to the current span...
+    if _root is None:
+        return
+    (_current.get() or _root).annotate(**attrs)
+
+
+def start(target=None, name='cliapi', **attrs):
+    # start tracing, target is a file name or None for stderr...
+    global _root, _target
+    _root = Span(name, attrs)
+    _root.start = time.perf_counter()
+    _current.set(None)
+    _target = target
+
+
+def requested(argv):
+    # is tracing asked for on the command line or in the environment?
+    # returns (requested, target)...
+    value = os.environ.get(ENV)
+    if '--timings' in argv:
+        return True, value if value not in (None, '', '1') else None
+    if value:
+        return True, None if value == '1' else value
+    return False, None
+
+
+def stop():
+    # stop tracing and write the span tree...
+    global _root
+    if _root is None:
+        return
+    root, _root = _root, None
+    root.end = time.perf_counter()
+    text = json.dumps(root.to_dict(root.start), indent=2)
+    if _target:
+        with open(_target, 'a') as f:
+            f.write(text + '\n')
+    else:
+        sys.stderr.write(text + '\n')
+
+
+def bind(function):
+    # run function (in another thread) as part of the current span...
+    if _root is None:
+        return function
+    context = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        return context.run(function, *args, **kwargs)
+    return bound
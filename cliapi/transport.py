@@ -0,0 +1,195 @@
+import os
+import time
+import json
+import random
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+from cliapi.timings import span
+
+# A small HTTP client shared by the provider plugins:
+#  - keep-alive connections, pooled per (scheme, host, port)
+#  - separate connect and read timeouts, so a hung endpoint can not
+#    block a cliapi call forever
+#  - retries with jittered exponential backoff on connection errors,
+#    429 and 5xx responses (honoring Retry-After)
+#  - ETag/If-None-Match revalidation of previously seen responses
+
+
+class HttpError(Exception):
+    # a response which is still an error after all retries...
+    def __init__(self, status, reason, url):
+        super().__init__('HTTP {} {} -- {}'.format(status, reason, url))
+        self.status = status
+        self.reason = reason
+        self.url = url
+
+
+class HttpClient(object):
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, connect_timeout=2.0, read_timeout=5.0, retries=3,
+                 backoff=0.25, max_backoff=5.0, max_idle=4):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_idle = max_idle
+        self.pools = {}
+        # url -> (etag, body) of the last good response...
+        self.etags = {}
+        self.stats = {'requests': 0, 'retries': 0, 'bytes': 0,
+                      'not_modified': 0, 'connections': 0}
+        self.lock = threading.Lock()
+
+    def _connect(self, scheme, host, port):
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port,
+                                               timeout=self.connect_timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port,
+                                              timeout=self.connect_timeout)
+        conn.connect()
+        # connected, from now on the read timeout applies...
+        conn.sock.settimeout(self.read_timeout)
+        with self.lock:
+            self.stats['connections'] += 1
+        return conn
+
+    def _acquire(self, key):
+        # an idle pooled connection or a new one, and whether it was reused...
+        with self.lock:
+            idle = self.pools.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(*key), False
+
+    def _release(self, key, conn):
+        with self.lock:
+            idle = self.pools.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+
+    def _delay(self, attempt, retry_after=None):
+        # "full jitter" exponential backoff...
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff * (2 ** attempt)))
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), self.max_backoff))
+            except ValueError:
+                # an HTTP-date, just use the backoff...
+                pass
+        return delay
+
+    def request(self, method, url, headers=None, body=None):
+        # returns (status, headers, body) of the final response...
+        with span('http ' + method, url=url) as s:
+            status, response_headers, data, attempt = self._request(
+                method, url, headers, body)
+            s.annotate(status=status, retries=attempt, bytes=len(data))
+        return status, response_headers, data
+
+    def _request(self, method, url, headers, body):
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {})
+
+        attempt = 0
+        while True:
+            conn, reused = None, False
+            try:
+                # (connecting is retried like the request itself)
+                conn, reused = self._acquire(key)
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                if conn is not None:
+                    conn.close()
+                if reused:
+                    # the server closed an idle keep-alive connection,
+                    # try again right away on a new one...
+                    continue
+                if attempt >= self.retries:
+                    raise
+                with self.lock:
+                    self.stats['retries'] += 1
+                time.sleep(self._delay(attempt))
+                attempt += 1
+                continue
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            with self.lock:
+                self.stats['requests'] += 1
+                self.stats['bytes'] += len(data)
+            if response.status in self.RETRY_STATUSES and \
+                    attempt < self.retries:
+                with self.lock:
+                    self.stats['retries'] += 1
+                time.sleep(self._delay(attempt,
+                                       response.getheader('Retry-After')))
+                attempt += 1
+                continue
+            return response.status, dict(response.getheaders()), data, attempt
+
+    def get(self, url, headers=None):
+        # GET the body of url, revalidating a previous response with
+        # If-None-Match when the endpoint gave it an ETag...
+        headers = dict(headers or {})
+        cached = self.etags.get(url)
+        if cached is not None:
+            headers['If-None-Match'] = cached[0]
+        status, response_headers, data = self.request('GET', url, headers)
+        if status == 304 and cached is not None:
+            with self.lock:
+                self.stats['not_modified'] += 1
+            return cached[1]
+        if status >= 400:
+            raise HttpError(status, http.client.responses.get(status, ''),
+                            url)
+        etag = {k.lower(): v for k, v in response_headers.items()}.get('etag')
+        if etag:
+            self.etags[url] = (etag, data)
+        return data
+
+    def get_json(self, url, headers=None):
+        return json.loads(self.get(url, headers).decode('utf-8'))
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def http_client():
+    # the client shared by all providers in this process, its timeouts
+    # and retries may be tuned through the environment...
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            env = os.environ.get
+            _shared = HttpClient(
+                connect_timeout=float(env('CLIAPI_HTTP_CONNECT_TIMEOUT', 2.0)),
+                read_timeout=float(env('CLIAPI_HTTP_READ_TIMEOUT', 5.0)),
+                retries=int(env('CLIAPI_HTTP_RETRIES', 3)))
+        return _shared
@@ -0,0 +1,75 @@
+import time
+
+# --watch: answer the same request every few seconds from a provider kept
+# in memory and write the answer only when it changed.  Answers are
+# compared by a structural hash, nothing is encoded between changes.
+# With --diff, changes after the first answer are written as JSON Patch
+# (RFC 6902) operations instead of the whole answer.
+
+
+def fingerprint(value):
+    # a hash of the JSON structure of value, whatever the order of its
+    # object keys (in-process only, python's string hashes are salted)...
+    if isinstance(value, dict):
+        return hash(('{', frozenset((key, fingerprint(item))
+                                    for key, item in value.items())))
+    if isinstance(value, (list, tuple)):
+        return hash(('[', tuple(fingerprint(item) for item in value)))
+    # (True, 1 and 1.0 hash alike)
+    return hash((type(value).__name__, value))
+
+
+def _pointer(path):
+    # a JSON pointer (RFC 6901)...
+    return ''.join('/' + str(key).replace('~', '~0').replace('/', '~1')
+                   for key in path)
+
+
+def diff(old, new, path=()):
+    # the JSON Patch turning old into new...
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key, value in old.items():
+            if key not in new:
+                ops.append({'op': 'remove', 'path': _pointer(path + (key,))})
+            elif fingerprint(value) != fingerprint(new[key]):
+                ops += diff(value, new[key], path + (key,))
+        for key, value in new.items():
+            if key not in old:
+                ops.append({'op': 'add', 'path': _pointer(path + (key,)),
+                            'value': value})
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        ops = []
+        for i, (a, b) in enumerate(zip(old, new)):
+            if fingerprint(a) != fingerprint(b):
+                ops += diff(a, b, path + (i,))
+        for i in range(len(old) - 1, len(new) - 1, -1):
+            # (from the end, so the indexes stay valid)
+            ops.append({'op': 'remove', 'path': _pointer(path + (i,))})
+        for i in range(len(old), len(new)):
+            ops.append({'op': 'add', 'path': _pointer(path + (i,)),
+                        'value': new[i]})
+        return ops
+    return [{'op': 'replace', 'path': _pointer(path), 'value': new}]
+
+
+def watch(answer, interval, write, patches=False):
+    # call answer() every interval seconds and write(value) what changed,
+    # until interrupted...
+    last = None
+    previous = None
+    try:
+        while True:
+            started = time.monotonic()
+            value = answer()
+            current = fingerprint(value)
+            if current != last:
+                if patches and last is not None:
+                    write(diff(previous, value))
+                else:
+                    write(value)
+                last, previous = current, value
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
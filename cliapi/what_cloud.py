@@ -1,15 +1,119 @@
-from os import popen
+import os
+import time
+from collections import namedtuple
+from subprocess import Popen, PIPE, DEVNULL
 
+from cliapi.cache import cache_dir, boot_id, read_json, atomic_write_json
+from cliapi.timings import span
 
-def determine_provider():
-    result = popen('/usr/sbin/dmidecode -t system').read()
-    output = result.lower()
+# Cloud detection...
+# The DMI strings exported by the kernel in sysfs are read first, dmidecode
+# is only spawned when sysfs has nothing useful.  The answer can only change
+# across a reboot, so it is kept in memory for this process and on disk
+# (keyed on the boot id) for every other cliapi process on this host.
+
+DMI_SYSFS = '/sys/class/dmi/id'
+DMI_FIELDS = ('sys_vendor', 'product_name', 'product_version',
+              'bios_vendor', 'bios_version', 'chassis_vendor',
+              'chassis_asset_tag', 'board_vendor')
+DMIDECODE = '/usr/sbin/dmidecode'
+
+# Azure VMs report a "Microsoft" vendor and this well known asset tag...
+AZURE_ASSET_TAG = '7783-7084-3265-9085-8269-3286-77'
+
+Detection = namedtuple('Detection', ['provider', 'method', 'elapsed'])
+
+_detected = None
+
+
+def _classify(output):
+    output = output.lower()
     if 'amazon' in output:
-        provider = 'ec2'
-    elif 'microsoft' in output:
-        provider = 'azure'
+        return 'ec2'
+    elif 'microsoft' in output or AZURE_ASSET_TAG in output:
+        return 'azure'
     elif 'google' in output:
-        provider = 'gce'
-    else:
+        return 'gce'
+    return None
+
+
+def _read_sysfs():
+    values = []
+    for field in DMI_FIELDS:
+        try:
+            with open(os.path.join(DMI_SYSFS, field)) as f:
+                values.append(f.read().strip())
+        except OSError:
+            # some fields are only readable by root...
+            continue
+    return '\n'.join(values)
+
+
+def _read_dmidecode():
+    try:
+        proc = Popen([DMIDECODE, '-t', 'system'],
+                     stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+    except OSError:
+        return ''
+    return proc.communicate()[0]
+
+
+def _cache_path():
+    return os.path.join(cache_dir(), 'what_cloud.json')
+
+
+def _load_cached():
+    try:
+        cached = read_json(_cache_path())
+    except OSError:
+        return None
+    if cached is None or cached.get('boot_id') != boot_id():
+        return None
+    return cached
+
+
+def _save(detection):
+    try:
+        atomic_write_json(_cache_path(), {'boot_id': boot_id(),
+                                          'provider': detection.provider,
+                                          'method': detection.method,
+                                          'elapsed': detection.elapsed})
+    except OSError:
+        # no place to remember it, detect again next time...
+        pass
+
+
+def detect(refresh=False):
+    # return a Detection of (provider, method, elapsed) where method is
+    # one of "memory", "cache", "sysfs" or "dmidecode" and provider is
+    # None when no known cloud was found...
+    global _detected
+    start = time.monotonic()
+    if _detected is not None and not refresh:
+        return _detected._replace(method='memory',
+                                  elapsed=time.monotonic() - start)
+    if not refresh:
+        cached = _load_cached()
+        if cached is not None:
+            _detected = Detection(cached['provider'], 'cache',
+                                  time.monotonic() - start)
+            return _detected
+
+    method = 'sysfs'
+    provider = _classify(_read_sysfs())
+    if provider is None:
+        method = 'dmidecode'
+        provider = _classify(_read_dmidecode())
+    _detected = Detection(provider, method, time.monotonic() - start)
+    _save(_detected)
+    return _detected
+
+
+def determine_provider():
+    with span('what_cloud') as s:
+        detection = detect()
+        s.annotate(provider=detection.provider, method=detection.method)
+    provider = detection.provider
+    if provider is None:
         raise Exception('Provider not found.')
     return provider